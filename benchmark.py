@@ -0,0 +1,203 @@
+"""
+Load benchmark of the control unit.
+
+Sends the questions of one or more request CSVs to /invoke (or /invoke/stream)
+from a pool of concurrent clients and reports throughput and latency percentiles.
+Run it against the LLM stand-in (llm-standin, Compose profile "bench") to measure
+the orchestration overhead without a GPU, e.g.:
+
+    docker compose --profile bench up -d
+    python benchmark.py --concurrency 8 --requests 200 --output bench.json
+
+With the plan cache or single-flight enabled, repeated questions skip the planner;
+set PLAN_CACHE_ENABLED=false and SINGLE_FLIGHT=off on the control unit to measure
+the full pipeline for every request.
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def load_questions(paths):
+    questions = []
+    for path in paths:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                key = next((k for k in row if "question" in k.lower()), None)
+                if key and row[key].strip():
+                    questions.append(row[key].strip())
+    return questions
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Client:
+
+    def __init__(self, base_url, mode, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.mode = mode
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def send(self, question):
+        """
+        Returns the measurement of one request.
+        """
+        started = time.perf_counter()
+        sample = {"question": question, "plan_seconds": None, "error": None, "tasks": {}}
+        try:
+            if self.mode == "stream":
+                result = self.send_stream(question, started, sample)
+            else:
+                response = self.session().post(f"{self.base_url}/invoke", json={"input": question}, timeout=self.timeout)
+                sample["http_status"] = response.status_code
+                result = response.json()
+                statuses = Counter(t.get("status", "UNKNOWN") for t in result.get("execution_results", []))
+                result = {**result, "statuses": dict(statuses)}
+            sample["error"] = result.get("error")
+            sample["tasks"] = result.get("statuses") or {}
+            sample["plan_cache"] = result.get("plan_cache")
+        except (requests.RequestException, ValueError) as e:
+            sample.setdefault("http_status", None)
+            sample["error"] = f"{type(e).__name__}: {e}"
+        sample["seconds"] = time.perf_counter() - started
+        return sample
+
+    def send_stream(self, question, started, sample):
+        url = f"{self.base_url}/invoke/stream?format=ndjson"
+        with self.session().post(url, json={"input": question}, stream=True, timeout=self.timeout) as response:
+            sample["http_status"] = response.status_code
+            summary = {}
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["event"] == "plan" and sample["plan_seconds"] is None:
+                    sample["plan_seconds"] = time.perf_counter() - started
+                elif message["event"] == "summary":
+                    summary = message["data"]
+                elif message["event"] == "error":
+                    summary = message["data"]
+            return summary
+
+
+def run(client, questions, concurrency, total, duration):
+    """
+    Sends `total` requests (or as many as fit in `duration` seconds) with
+    `concurrency` requests in flight, cycling through the questions.
+    """
+    samples = []
+    lock = threading.Lock()
+    source = itertools.cycle(questions)
+    deadline = time.monotonic() + duration if duration else None
+    sent = itertools.count()
+
+    def worker():
+        while True:
+            with lock:
+                if next(sent) >= total or (deadline and time.monotonic() >= deadline):
+                    return
+                question = next(source)
+            sample = client.send(question)
+            with lock:
+                samples.append(sample)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, elapsed, concurrency):
+    latencies = sorted(s["seconds"] for s in samples)
+    plan_latencies = sorted(s["plan_seconds"] for s in samples if s["plan_seconds"] is not None)
+    tasks = Counter()
+    for s in samples:
+        tasks.update(s["tasks"])
+
+    def distribution(values):
+        if not values:
+            return None
+        return {
+            "mean": round(sum(values) / len(values), 4),
+            "p50": round(percentile(values, 50), 4),
+            "p95": round(percentile(values, 95), 4),
+            "p99": round(percentile(values, 99), 4),
+            "max": round(values[-1], 4),
+        }
+
+    return {
+        "requests": len(samples),
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 3) if elapsed else None,
+        "latency_seconds": distribution(latencies),
+        "time_to_plan_seconds": distribution(plan_latencies),
+        "http_statuses": dict(Counter(str(s.get("http_status")) for s in samples)),
+        "errors": sum(1 for s in samples if s["error"]),
+        "error_messages": dict(Counter(s["error"] for s in samples if s["error"]).most_common(10)),
+        "task_statuses": dict(tasks),
+        "plan_cache": dict(Counter(str(s.get("plan_cache")) for s in samples)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control unit load benchmark")
+    parser.add_argument("--url", default="http://localhost:5500/api/control", help="Control unit API base URL")
+    parser.add_argument("--questions", nargs="+", default=["smart-city-requests/requests_no_roles.csv"],
+                        help="CSV files with a Questions column")
+    parser.add_argument("--mode", choices=("invoke", "stream"), default="invoke")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=None, help="Requests to send (default: one per question)")
+    parser.add_argument("--duration", type=float, default=None, help="Stop sending after this many seconds")
+    parser.add_argument("--warmup", type=int, default=1, help="Requests sent before measuring")
+    parser.add_argument("--timeout", type=float, default=900)
+    parser.add_argument("--output", default=None, help="Write the report and all samples as JSON")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    if not questions:
+        parser.error("No questions found")
+    client = Client(args.url, args.mode, args.timeout)
+
+    for question in questions[:args.warmup]:
+        client.send(question)
+
+    total = args.requests or (math.inf if args.duration else len(questions))
+    samples, elapsed = run(client, questions, args.concurrency, total, args.duration)
+    report = summarize(samples, elapsed, args.concurrency)
+    try:
+        report["llm_stats"] = requests.get(f"{args.url.rstrip('/')}/llm/stats", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        report["llm_stats"] = None
+
+    print(json.dumps({k: v for k, v in report.items() if k != "llm_stats"}, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"report": report, "samples": samples}, f, indent=2)
+        print(f"Report saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+# Shared by control-unit and db-gateway: both images copy the common/ package.
+
+# "off", "header" (profile requests sent with X-Profile: true) or "always".
+PROFILING = os.environ.get("PROFILING", "off").lower()
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "10"))
+PROFILE_TRACEMALLOC = os.environ.get("PROFILE_TRACEMALLOC", "true").lower() == "true"
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", "10"))
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "50"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "100"))
+PROFILE_HEADER = "X-Profile"
+
+# Innermost frames of threads that are waiting rather than working.
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "socket.py", "ssl.py")
+IDLE_FUNCTIONS = {"select", "poll", "accept", "wait", "_worker", "run_forever", "_run_once"}
+
+logger = logging.getLogger("profiling")
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False
+
+
+class Sampler(threading.Thread):
+    """
+    Statistical profiler: every PROFILE_INTERVAL_MS it records the Python stack of
+    every thread, except threads blocked waiting, and counts identical stacks.
+    All threads are sampled because a request's work runs outside its own thread
+    (event loop, executors), so concurrent requests show up in the profile too.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if code.co_name in IDLE_FUNCTIONS or os.path.basename(code.co_filename) in IDLE_FILES:
+                    self.idle += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def folded(self):
+        """
+        The samples in collapsed-stack format, one `frame;frame;... count` line per
+        stack, as read by flamegraph.pl and speedscope.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+        tracemalloc.reset_peak()
+    return _snapshot()
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+class Profile:
+    """
+    Profile of one request: a sampling profile and, with PROFILE_TRACEMALLOC, the
+    allocations made while it ran, as a diff of two tracemalloc snapshots.
+    """
+
+    def __init__(self, method, path):
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")[:60]
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self.id = f"{stamp}-{uuid.uuid4().hex[:8]}-{method.lower()}-{slug}"
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self.before = _start_tracemalloc() if PROFILE_TRACEMALLOC else None
+        self.sampler = Sampler(PROFILE_INTERVAL_MS / 1000)
+        self.sampler.start()
+
+    def finish(self, status=None, trace_id=None):
+        """
+        Stops profiling and writes <id>.folded, <id>.alloc.txt and <id>.json to PROFILE_DIR.
+        """
+        duration = time.perf_counter() - self._clock
+        self.sampler.stop()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = self.id
+        meta = {
+            "id": name,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "trace_id": trace_id,
+            "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            "duration_ms": round(duration * 1000, 1),
+            "samples": self.sampler.samples,
+            "idle_samples": self.sampler.idle,
+            "files": [f"{name}.folded"],
+        }
+        with open(os.path.join(PROFILE_DIR, f"{name}.folded"), "w", encoding="utf-8") as f:
+            f.write(self.sampler.folded())
+
+        if self.before is not None:
+            try:
+                after = _snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                _stop_tracemalloc()
+            diff = after.compare_to(self.before, "lineno")
+            meta["allocated_bytes"] = sum(stat.size_diff for stat in diff)
+            meta["peak_traced_bytes"] = peak
+            meta["files"].append(f"{name}.alloc.txt")
+            with open(os.path.join(PROFILE_DIR, f"{name}.alloc.txt"), "w", encoding="utf-8") as f:
+                f.write(f"Top {PROFILE_TOP} allocation sites by growth during {self.method} {self.path}\n")
+                f.write("".join(f"{stat}\n" for stat in diff[:PROFILE_TOP]))
+
+        with open(os.path.join(PROFILE_DIR, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        _prune()
+        logger.info(f"[PROFILE] {self.method} {self.path}: {meta['duration_ms']} ms, "
+                    f"{self.sampler.samples} samples, written to {PROFILE_DIR}/{name}.*")
+        return meta
+
+
+def _prune():
+    profiles = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".json"))
+    for old in profiles[:max(0, len(profiles) - PROFILE_KEEP)]:
+        stem = old[:-len(".json")]
+        for suffix in (".json", ".folded", ".alloc.txt"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, stem + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """
+    Metadata of the stored profiles, newest first.
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted((f for f in os.listdir(PROFILE_DIR) if f.endswith(".json")), reverse=True):
+        try:
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def requested(headers):
+    if PROFILING == "always":
+        return True
+    return PROFILING == "header" and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
+
+def instrument_flask(app, prefix=""):
+    """
+    Profiles the requests of a Flask app that ask for it (see PROFILING) and serves
+    the stored profiles at {prefix}/debug/profiles and {prefix}/debug/profiles/<file>.
+    Nothing is registered when PROFILING is off.
+    """
+    if PROFILING == "off":
+        return
+    from flask import g, request, jsonify, send_from_directory, abort
+
+    def finish(profile, status, trace_id):
+        try:
+            profile.finish(status, trace_id)
+        except OSError as e:
+            logger.warning(f"[PROFILE] Cannot write the profile of {profile.method} {profile.path}: {e}")
+
+    @app.before_request
+    def start_profile():
+        if requested(request.headers) and not request.path.startswith(f"{prefix}/debug/profiles"):
+            g.profile = Profile(request.method, request.path)
+
+    @app.after_request
+    def finish_on_close(response):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            response.headers["X-Profile-Id"] = profile.id
+            span = g.get("trace_span")
+            trace_id = span.trace_id if span is not None else None
+            # A streamed body is generated after the request ends, until the server closes the response.
+            response.call_on_close(lambda: finish(profile, response.status_code, trace_id))
+        return response
+
+    @app.teardown_request
+    def finish_without_response(error):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            finish(profile, 500 if error else None, None)
+
+    def profiles_index():
+        return jsonify({"mode": PROFILING, "directory": PROFILE_DIR, "profiles": list_profiles()})
+
+    def profile_file(name):
+        if not name.endswith((".json", ".folded", ".alloc.txt")):
+            abort(404)
+        return send_from_directory(os.path.abspath(PROFILE_DIR), name)
+
+    app.add_url_rule(f"{prefix}/debug/profiles", "profiles_index", profiles_index, methods=["GET"])
+    app.add_url_rule(f"{prefix}/debug/profiles/<path:name>", "profile_file", profile_file, methods=["GET"])
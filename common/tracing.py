@@ -0,0 +1,289 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+# Shared by control-unit and db-gateway: both images copy the common/ package.
+
+# "none" (propagate trace context only), "file" or "otlp".
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATIO = float(os.environ.get("TRACE_SAMPLE_RATIO", "1.0"))
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", "4096"))
+TRACE_FLUSH_SECONDS = float(os.environ.get("TRACE_FLUSH_SECONDS", "2"))
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "unknown_service")
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318").rstrip("/") + "/v1/traces"
+
+TRACEPARENT_PATTERN = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$")
+
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+logger = logging.getLogger("tracing")
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class RemoteParent:
+    """
+    The span context received from another service in a traceparent header.
+    """
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+def parse_traceparent(header):
+    """
+    Returns the RemoteParent of a W3C traceparent header, or None if it is missing or invalid.
+    """
+    match = TRACEPARENT_PATTERN.match((header or "").strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest) or set(trace_id) == {"0"} or set(span_id) == {"0"}:
+        return None
+    return RemoteParent(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+class Span:
+
+    def __init__(self, name, parent=None, kind=INTERNAL, attributes=None):
+        if parent is None:
+            self.trace_id = secrets.token_hex(16)
+            self.parent_id = None
+            self.sampled = random.random() < TRACE_SAMPLE_RATIO
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.sampled = parent.sampled
+        self.span_id = secrets.token_hex(8)
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = (STATUS_ERROR, str(message))
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            get_exporter().export(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status is not None:
+            span["status"] = {"code": self.status[0], "message": self.status[1]}
+        return span
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Exporter:
+    """
+    Exports finished spans from a background thread in batches, encoded as OTLP/JSON:
+    POSTed to an OTLP/HTTP collector, or appended to TRACE_FILE one batch per line
+    (the format of the collector's file exporter, readable by its otlpjsonfile receiver).
+    Spans are dropped rather than slowing requests down when the queue is full.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.spans = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        if self.mode not in ("file", "otlp"):
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="trace-exporter", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+        try:
+            self.spans.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        batch = []
+        while len(batch) < 512:
+            try:
+                batch.append(self.spans.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            time.sleep(TRACE_FLUSH_SECONDS)
+            self.flush()
+
+    def flush(self):
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            payload = {
+                "resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": [span.to_otlp() for span in batch]}]
+                }]
+            }
+            try:
+                if self.mode == "file":
+                    with self._lock, open(TRACE_FILE, "a", encoding="utf-8") as handle:
+                        handle.write(json.dumps(payload) + "\n")
+                else:
+                    request = urllib.request.Request(
+                        OTLP_ENDPOINT, data=json.dumps(payload).encode("utf-8"),
+                        headers={"Content-Type": "application/json"}, method="POST"
+                    )
+                    with urllib.request.urlopen(request, timeout=5) as response:
+                        response.read()
+            except (OSError, ValueError) as e:
+                logger.warning(f"[TRACING] Dropped {len(batch)} spans, export failed: {e}")
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = Exporter(TRACE_EXPORTER)
+    return _exporter
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def span(name, kind=INTERNAL, parent=None, **attributes):
+    """
+    Starts a span as a child of `parent` (by default the current span) and makes it
+    current for the duration of the block. Exceptions mark the span as failed.
+    """
+    current = Span(name, parent if parent is not None else _current.get(), kind, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+async def bound(coroutine, parent):
+    """
+    Runs a coroutine submitted to another thread's event loop under `parent`, e.g.
+    the server span of the request that submitted it.
+    """
+    _current.set(parent)
+    return await coroutine
+
+
+def inject(headers=None):
+    """
+    Adds the traceparent header of the current span to `headers` (a new dict by default).
+    """
+    headers = {} if headers is None else headers
+    current = _current.get()
+    if current is not None:
+        headers["traceparent"] = f"00-{current.trace_id}-{current.span_id}-{'01' if current.sampled else '00'}"
+    return headers
+
+
+def instrument_flask(app):
+    """
+    Opens a server span for every request of a Flask app, continuing the trace of
+    the caller's traceparent header, and returns the span's traceparent in the response.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_request_span():
+        server_span = Span(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            parse_traceparent(request.headers.get("traceparent")),
+            SERVER,
+            {"http.request.method": request.method, "url.path": request.path}
+        )
+        g.trace_span = server_span
+        g.trace_token = _current.set(server_span)
+
+    @app.after_request
+    def add_traceparent(response):
+        server_span = g.get("trace_span")
+        if server_span is not None:
+            server_span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 500:
+                server_span.set_error(f"HTTP {response.status_code}")
+            response.headers["traceparent"] = server_span.traceparent
+        return response
+
+    @app.teardown_request
+    def end_request_span(error):
+        server_span = g.pop("trace_span", None)
+        token = g.pop("trace_token", None)
+        if server_span is None:
+            return
+        if error is not None:
+            server_span.set_error(f"{type(error).__name__}: {error}")
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Reset from another context (e.g. a streamed response): just clear it.
+            _current.set(None)
+        server_span.end()
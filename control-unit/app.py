@@ -1,10 +1,22 @@
 from flask import Flask
 from flask_restx import Api
 from controller import controlUnitController
+from common import tracing, profiling
+from service import promptEncoding
 from cheroot.wsgi import Server
+import logging
+import os
+
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+promptEncoding.load_tokenizer()
 
 app = Flask(__name__)
 app.config['BUNDLE_ERRORS'] = True
+tracing.instrument_flask(app)
 
 api = Api(app, 
           title="Control unit", 
@@ -13,11 +25,14 @@ api = Api(app,
           doc="/swagger")
 
 BASE_PATH = "/api"
+# Job long-polls hold a thread each for up to JOB_MAX_WAIT: keep well above JOB_MAX_POLLERS.
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "32"))
 
 api.add_namespace(controlUnitController.api, path=f"{BASE_PATH}/control")
+profiling.instrument_flask(app, prefix=f"{BASE_PATH}/control")
 
 if __name__ == "__main__":
-    server = Server(("0.0.0.0", 5500), app)
+    server = Server(("0.0.0.0", 5500), app, numthreads=SERVER_THREADS)
     try:
         server.start()
     except KeyboardInterrupt:
@@ -1,9 +1,36 @@
-from flask import request, jsonify, Response
-from flask_restx import Namespace, Resource, reqparse
+from flask import request, jsonify, Response, stream_with_context, send_file
+from flask_restx import Namespace, Resource, reqparse, abort
 from werkzeug.datastructures import FileStorage
-from service.discoveryService import Discovery
-from service.controlService import Controller
+from service.controlService import Controller, BatchController, blob_store, query_flights
+from service.jobService import JobManager, JobQueueFull
+from service.llmGateway import AdmissionRejected, gateway_stats
+from service.llmBackends import get_backend_pool
+from service.cascadePlanner import cascade_stats
+from service.contextBudget import context_budget
 from langchain_ollama import ChatOllama
+import threading
+import queue
+import json
+import logging
+import math
+import time
+import os
+from collections import Counter
+from concurrent.futures import CancelledError
+
+logger = logging.getLogger("control-unit")
+
+job_manager = JobManager()
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", "60"))
+# Long-polls hold a server thread each; past this many, polls answer at once so
+# the remaining SERVER_THREADS stay free for other requests.
+JOB_MAX_POLLERS = int(os.environ.get("JOB_MAX_POLLERS", "16"))
+long_polls = threading.BoundedSemaphore(JOB_MAX_POLLERS)
+# Default LLM queue priority per X-Caller value; lower values are served first.
+CALLER_PRIORITIES = json.loads(os.environ.get("LLM_CALLER_PRIORITIES", "{}"))
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "64"))
+# Idle streams send a keep-alive this often; writing is how a closed connection is noticed.
+STREAM_KEEPALIVE_SECONDS = float(os.environ.get("STREAM_KEEPALIVE_SECONDS", "15"))
 
 api = Namespace("control", description="Services management and orchestration")
 control_unit_parser = reqparse.RequestParser()
@@ -21,6 +48,44 @@ category_model = api.schema_model(
     },
 )
 
+def admission(data):
+    """
+    LLM queue priority and time budget (seconds) of a request, from the X-Priority /
+    X-Deadline-Ms headers, the "priority" / "deadline_ms" body fields or the X-Caller default.
+    """
+    priority = request.headers.get("X-Priority", data.get("priority"))
+    if priority is None:
+        priority = CALLER_PRIORITIES.get(request.headers.get("X-Caller"), 0)
+    deadline_ms = request.headers.get("X-Deadline-Ms", data.get("deadline_ms"))
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        abort(400, error=f"Invalid priority: {priority!r}")
+    budget = None
+    if deadline_ms is not None:
+        budget = number(deadline_ms, "deadline_ms") / 1000
+        if budget <= 0:
+            abort(400, error=f"Invalid deadline_ms: {deadline_ms!r}")
+    return {"priority": priority, "budget": budget}
+
+
+def number(value, name):
+    """
+    A finite float from a header, body field or query argument, or a 400 response.
+    """
+    try:
+        parsed = float(value)
+    except (TypeError, ValueError):
+        parsed = math.nan
+    if not math.isfinite(parsed):
+        abort(400, error=f"Invalid {name}: {value!r}")
+    return parsed
+
+
+def rejected(e):
+    return {"error": str(e), "retry_after": e.retry_after}, 503, {"Retry-After": str(e.retry_after)}
+
+
 @api.route("/invoke")
 @api.expect(category_model)
 class ConversationalAgent(Resource):
@@ -28,9 +93,237 @@ class ConversationalAgent(Resource):
 
         data = request.get_json(force=True)
         user_input = data['input']
-        print(f"Input ricevuto: {user_input}")
+        logger.info(f"Input ricevuto: {user_input}")
 
-        controller = Controller()
-        results = controller.control(user_input)
+        controller = Controller(**admission(data))
+        try:
+            results = controller.control(user_input)
+        except AdmissionRejected as e:
+            return rejected(e)
         return jsonify(results)
 
+
+def format_event(stream_format, event, payload):
+    if stream_format == "ndjson":
+        return json.dumps({"event": event, "data": payload}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def stream_work(events, work, cancel, stream_format, description):
+    """
+    Runs work() on a worker thread and streams the events put on `events`, then
+    the summary work() returns (or the error it raised). When the client goes away
+    before the end, the generator is closed and cancel() stops the work.
+    """
+    def run():
+        try:
+            events.put(("summary", work()))
+        except CancelledError:
+            logger.info(f"{description} cancelled by client")
+        except AdmissionRejected as e:
+            events.put(("error", {"error": str(e), "retry_after": e.retry_after}))
+        except Exception as e:
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    keepalive = "\n" if stream_format == "ndjson" else ": keepalive\n\n"
+
+    def generate():
+        finished = False
+        try:
+            while True:
+                try:
+                    item = events.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield keepalive
+                    continue
+                if item is None:
+                    finished = True
+                    break
+                event, payload = item
+                yield format_event(stream_format, event, payload)
+        finally:
+            if not finished:
+                cancel()
+
+    mimetype = "application/x-ndjson" if stream_format == "ndjson" else "text/event-stream"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def summarize(results, started):
+    statuses = Counter(r.get("status", "UNKNOWN") for r in results.get("execution_results", []))
+    return {
+        "tasks": sum(statuses.values()),
+        "statuses": dict(statuses),
+        "plan_cache": results.get("plan_cache"),
+        "prompt_tokens": results.get("prompt_tokens"),
+        "error": results.get("error"),
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1)
+    }
+
+
+@api.route("/invoke/stream")
+@api.expect(category_model)
+class ConversationalAgentStream(Resource):
+    def post(self):
+        """
+        Streams progress as SSE (default) or NDJSON (?format=ndjson): the candidate
+        services, the plan as soon as it is extracted, each task result as it
+        completes and a final summary. LLM tokens are included with ?tokens=true.
+        Closing the connection cancels the request.
+        """
+
+        data = request.get_json(force=True)
+        user_input = data['input']
+        logger.info(f"Input ricevuto (stream): {user_input}")
+
+        stream_format = request.args.get("format", "sse")
+        if stream_format not in ("sse", "ndjson"):
+            return {"error": f"Unsupported stream format: {stream_format}"}, 400
+        include_tokens = request.args.get("tokens", "false").lower() == "true"
+
+        events = queue.Queue()
+
+        def on_event(event, payload):
+            if event != "token" or include_tokens:
+                events.put((event, payload))
+
+        controller = Controller(on_event=on_event, **admission(data))
+        started = time.monotonic()
+        return stream_work(
+            events, lambda: summarize(controller.control(user_input), started), controller.cancel,
+            stream_format, f"Stream of '{user_input}'"
+        )
+
+
+batch_model = api.schema_model(
+    "BatchSchema",
+    {
+        "type": "object",
+        "properties": {
+            "inputs": {"type": "array", "items": {"type": "string"}},
+        },
+        "example": {
+            "inputs": ["first question", "second question"]
+        },
+    },
+)
+
+
+@api.route("/invoke/batch")
+@api.expect(batch_model)
+class ConversationalAgentBatch(Resource):
+    def post(self):
+        """
+        Runs many queries in one call. Results are streamed as NDJSON (default) or
+        SSE (?format=sse) in completion order, each tagged with its index, followed
+        by a summary; ?stream=false returns all results at once in input order.
+        """
+
+        data = request.get_json(force=True)
+        inputs = data.get("inputs")
+        if not isinstance(inputs, list) or not inputs:
+            return {"error": "Missing 'inputs' list"}, 400
+        if len(inputs) > BATCH_MAX_QUERIES:
+            return {"error": f"At most {BATCH_MAX_QUERIES} inputs per batch"}, 400
+        inputs = [str(user_input) for user_input in inputs]
+        logger.info(f"Batch ricevuto: {len(inputs)} input")
+
+        stream_format = request.args.get("format", "ndjson")
+        if stream_format not in ("sse", "ndjson"):
+            return {"error": f"Unsupported stream format: {stream_format}"}, 400
+        started = time.monotonic()
+
+        if request.args.get("stream", "true").lower() != "true":
+            batch = BatchController(inputs, **admission(data))
+            results = batch.run()
+            return jsonify([{"index": i, "input": q, **r} for i, (q, r) in enumerate(zip(inputs, results))])
+
+        events = queue.Queue()
+
+        def on_result(index, user_input, result):
+            events.put(("result", {"index": index, "input": user_input, **result}))
+
+        batch = BatchController(inputs, on_result=on_result, **admission(data))
+
+        def run():
+            results = batch.run()
+            return {
+                "inputs": len(inputs),
+                "failed": sum(1 for r in results if r.get("error")),
+                "elapsed_ms": round((time.monotonic() - started) * 1000, 1)
+            }
+
+        return stream_work(events, run, batch.cancel, stream_format, f"Batch of {len(inputs)} input")
+
+
+@api.route("/blobs/<string:blob_id>")
+class ToolResponseBlob(Resource):
+    def get(self, blob_id):
+        path = blob_store.path(blob_id)
+        if path is None:
+            return {"error": "Blob not found"}, 404
+        return send_file(path, mimetype="application/octet-stream")
+
+
+@api.route("/jobs")
+@api.expect(category_model)
+class Jobs(Resource):
+    def post(self):
+
+        data = request.get_json(force=True)
+        user_input = data['input']
+        logger.info(f"Input ricevuto (job): {user_input}")
+
+        try:
+            job = job_manager.submit(user_input, **admission(data))
+        except JobQueueFull as e:
+            return {"error": str(e)}, 429, {"Retry-After": "5"}
+        return {"job_id": job.id, "status": job.status, "location": f"{request.path}/{job.id}"}, 202
+
+
+@api.route("/jobs/<string:job_id>")
+class JobStatus(Resource):
+    def get(self, job_id):
+        """
+        Job status, plan and results. Long-poll with ?wait=<seconds>&since=<version>;
+        when JOB_MAX_POLLERS polls are already waiting, the current state is returned at once.
+        """
+        wait = min(number(request.args.get("wait", 0), "wait"), JOB_MAX_WAIT)
+        since = request.args.get("since", type=int)
+        if wait > 0 and since is None:
+            since = -1
+        polling = wait > 0 and long_polls.acquire(blocking=False)
+        try:
+            snapshot = job_manager.get(job_id, since=since, wait=wait if polling else 0)
+        finally:
+            if polling:
+                long_polls.release()
+        if snapshot is None:
+            return {"error": "Job not found"}, 404
+        return snapshot, 200
+
+    def delete(self, job_id):
+        snapshot = job_manager.cancel(job_id)
+        if snapshot is None:
+            return {"error": "Job not found"}, 404
+        return snapshot, 200
+
+
+@api.route("/llm/stats")
+class LLMStats(Resource):
+    def get(self):
+        """
+        Health, loaded models and in-flight/queued generations per LLM backend,
+        plus the hit rate of the cascade planner, the coalesced identical queries and
+        the context sizes requested from the planner.
+        """
+        return {
+            "backends": get_backend_pool().stats(),
+            "gateways": gateway_stats(),
+            "cascade": cascade_stats.snapshot(),
+            "single_flight": query_flights.snapshot(),
+            "context": context_budget.stats()
+        }, 200
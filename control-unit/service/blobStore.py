@@ -0,0 +1,65 @@
+import os
+import re
+import threading
+import time
+import uuid
+
+BLOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BlobStore:
+    """
+    Local directory holding tool response bodies that exceed the inline size cap.
+    Blobs are referenced by id, no longer served after TOOL_BLOB_TTL seconds and
+    removed by a background thread every TOOL_BLOB_SWEEP_INTERVAL seconds.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get("TOOL_BLOB_DIR", "/tmp/control-unit-blobs")
+        self.ttl = float(os.environ.get("TOOL_BLOB_TTL", "3600"))
+        self.max_bytes = int(os.environ.get("TOOL_BLOB_MAX_BYTES", str(50 * 1024 * 1024)))
+        self.sweep_interval = float(os.environ.get("TOOL_BLOB_SWEEP_INTERVAL", str(min(self.ttl, 300))))
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sweep, name="blob-expiry", daemon=True)
+                self._thread.start()
+        return self
+
+    def _sweep(self):
+        while True:
+            self.expire()
+            time.sleep(self.sweep_interval)
+
+    def path(self, blob_id):
+        if not BLOB_ID_PATTERN.match(blob_id or ""):
+            return None
+        path = os.path.join(self.directory, blob_id)
+        try:
+            if os.path.getmtime(path) < time.time() - self.ttl:
+                return None
+        except OSError:
+            return None
+        return path
+
+    def create(self):
+        """
+        Returns the id and the open file of a new blob. Blocking: call it off the event loop.
+        """
+        self.start()
+        blob_id = uuid.uuid4().hex
+        return blob_id, open(os.path.join(self.directory, blob_id), "wb")
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+
+IDEMPOTENT_OPERATIONS = {"GET", "PUT", "DELETE"}
+
+
+class CallPolicy:
+    """
+    Timeout, retry, hedging and circuit-breaker settings for the calls made to one service.
+    """
+
+    def __init__(self, **overrides):
+        self.timeout = float(os.environ.get("TOOL_TIMEOUT", "5"))
+        self.retries = int(os.environ.get("TOOL_RETRIES", "2"))
+        self.backoff = float(os.environ.get("TOOL_BACKOFF", "0.2"))
+        self.backoff_max = float(os.environ.get("TOOL_BACKOFF_MAX", "2"))
+        self.hedge = os.environ.get("TOOL_HEDGE", "false").lower() == "true"
+        self.hedge_percentile = float(os.environ.get("TOOL_HEDGE_PERCENTILE", "95"))
+        self.hedge_delay = float(os.environ.get("TOOL_HEDGE_DELAY", "0.5"))
+        self.breaker_threshold = int(os.environ.get("TOOL_BREAKER_THRESHOLD", "5"))
+        self.breaker_cooldown = float(os.environ.get("TOOL_BREAKER_COOLDOWN", "30"))
+        for key, value in overrides.items():
+            if not hasattr(self, key):
+                raise ValueError(f"Unknown call policy option: {key}")
+            current = getattr(self, key)
+            if isinstance(current, bool) and isinstance(value, str):
+                value = value.lower() == "true"
+            setattr(self, key, type(current)(value))
+
+    def backoff_delay(self, attempt):
+        # Full jitter: uniform in [0, min(max, base * 2^attempt)].
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and fails fast for `cooldown`
+    seconds, then lets a single probe through (half-open).
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def release_probe(self):
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, percentile, min_samples=10):
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+
+class CallPolicies:
+    """
+    Per-service policies (TOOL_POLICIES, a JSON object keyed by service id) plus the
+    per-endpoint breaker and latency state. Only touched from the shared event loop.
+    """
+
+    def __init__(self):
+        self.default = CallPolicy()
+        self.overrides = {
+            service_id: CallPolicy(**options)
+            for service_id, options in json.loads(os.environ.get("TOOL_POLICIES", "{}")).items()
+        }
+        self.breakers = {}
+        self.latencies = {}
+
+    def for_service(self, service_id):
+        return self.overrides.get(service_id, self.default)
+
+    def breaker(self, key, policy):
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(policy.breaker_threshold, policy.breaker_cooldown)
+        return self.breakers[key]
+
+    def latency(self, key):
+        if key not in self.latencies:
+            self.latencies[key] = LatencyTracker()
+        return self.latencies[key]
+
+    async def hedged(self, send, key, policy):
+        """
+        Issues send() and, if it has not completed after the tracked percentile
+        latency, a duplicate; the first successful response wins.
+        """
+        delay = self.latency(key).percentile(policy.hedge_percentile) or policy.hedge_delay
+        pending = {asyncio.ensure_future(send())}
+        error = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                pending.add(asyncio.ensure_future(send()))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,43 @@
+import os
+import threading
+from collections import Counter
+
+CASCADE_ENABLED = os.environ.get("CASCADE_ENABLED", "false").lower() == "true"
+CASCADE_MODEL = os.environ.get("CASCADE_MODEL", "qwen2.5:7b-instruct")
+CASCADE_MODEL_THINKS = os.environ.get("CASCADE_MODEL_THINKS", "false").lower() == "true"
+
+
+class CascadeStats:
+    """
+    Outcomes of the cascade planner: how many drafts of the fast model were
+    accepted, why the others escalated to the reasoning model, and the time
+    spent in each stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.outcomes = Counter()
+        self.seconds = Counter()
+
+    def record(self, outcome, draft_seconds, full_seconds=0.0):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.seconds["draft"] += draft_seconds
+            self.seconds["full"] += full_seconds
+
+    def snapshot(self):
+        with self._lock:
+            total = sum(self.outcomes.values())
+            escalated = total - self.outcomes["accepted"]
+            return {
+                "enabled": CASCADE_ENABLED,
+                "fast_model": CASCADE_MODEL,
+                "requests": total,
+                "outcomes": dict(self.outcomes),
+                "hit_rate": round(self.outcomes["accepted"] / total, 3) if total else None,
+                "avg_draft_seconds": round(self.seconds["draft"] / total, 2) if total else None,
+                "avg_full_seconds": round(self.seconds["full"] / escalated, 2) if escalated else None
+            }
+
+
+cascade_stats = CascadeStats()
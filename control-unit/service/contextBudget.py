@@ -0,0 +1,84 @@
+import os
+import threading
+
+# Context sizes (num_ctx) the planner may be called with. Ollama reloads a model,
+# dropping its prefix KV cache, when num_ctx changes: one bucket by default, and
+# with several the backend pool prefers a backend already running the size.
+PLANNER_CONTEXT_BUCKETS = sorted(
+    int(size) for size in os.environ.get("PLANNER_CONTEXT_BUCKETS", "8192").split(",") if size.strip()
+)
+# Tokens reserved for the reply, thinking included. Reasoning traces often run
+# past 2048 tokens, so the reserve is not sent as num_predict to thinking models.
+PLANNER_OUTPUT_TOKENS = int(os.environ.get("PLANNER_OUTPUT_TOKENS", "4096"))
+# Initial ratio between the catalog gateway's token count of a candidate (its own
+# tokenizer, JSON form) and the planner's count of its compact encoding.
+CATALOG_TOKEN_RATIO = float(os.environ.get("CATALOG_TOKEN_RATIO", "2.0"))
+CATALOG_RATIO_ALPHA = 0.2
+
+
+class ContextBudget:
+    """
+    Token budget of the planner prompt. The control unit asks the catalog gateway
+    for as many candidates as fit in the largest context next to the static
+    prompt, the query and the reply, converted to the gateway's token units with
+    a ratio learned from the gateway's reported counts. Each prompt is then sent
+    with the smallest context bucket that holds it and the reply.
+    """
+
+    def __init__(self, buckets=None, output_tokens=PLANNER_OUTPUT_TOKENS):
+        self.output_tokens = output_tokens
+        # A bucket must leave room for a prompt next to the reply reserve.
+        self.buckets = [size for size in buckets or PLANNER_CONTEXT_BUCKETS if size > output_tokens] or [2 * output_tokens]
+        self.ratio = CATALOG_TOKEN_RATIO
+        self._lock = threading.Lock()
+        self.contexts = {size: 0 for size in self.buckets}
+
+    @property
+    def max_prompt_tokens(self):
+        return self.buckets[-1] - self.output_tokens
+
+    def context_size(self, prompt_tokens):
+        """
+        The smallest bucket holding the prompt and the reply, or the largest one.
+        """
+        needed = prompt_tokens + self.output_tokens
+        size = next((size for size in self.buckets if size >= needed), self.buckets[-1])
+        with self._lock:
+            self.contexts[size] += 1
+        return size
+
+    def catalog_tokens(self, overhead_tokens):
+        """
+        Planner tokens left for the candidate services next to `overhead_tokens`
+        (static instructions, query and section headers).
+        """
+        return max(0, self.max_prompt_tokens - overhead_tokens)
+
+    def catalog_request(self, overhead_tokens):
+        """
+        The max_tokens to ask the catalog gateway for, in its token units.
+        """
+        with self._lock:
+            return int(self.catalog_tokens(overhead_tokens) * self.ratio)
+
+    def observe_catalog(self, gateway_tokens, planner_tokens):
+        """
+        Updates the token ratio with the gateway's count and the planner's count
+        of the same candidates.
+        """
+        if not gateway_tokens or not planner_tokens:
+            return
+        with self._lock:
+            self.ratio += CATALOG_RATIO_ALPHA * (gateway_tokens / planner_tokens - self.ratio)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buckets": self.buckets,
+                "output_tokens": self.output_tokens,
+                "catalog_token_ratio": round(self.ratio, 3),
+                "contexts": {str(size): count for size, count in self.contexts.items()},
+            }
+
+
+context_budget = ContextBudget()
@@ -1,138 +1,462 @@
-from service.discoveryService import Discovery
+from service.discoveryService import get_registry
+from service.planCache import PlanCache
+from service.planStream import PlanStreamParser
+from service.httpPool import get_session, get_runner
+from service.planExecutor import PlanExecutor
+from service.callPolicy import CallPolicies, IDEMPOTENT_OPERATIONS
+from service.responseCache import ResponseCache
+from service.blobStore import BlobStore
+from service.llmGateway import get_gateway, AdmissionRejected
+from service.llmBackends import get_backend_pool, BackendUnavailable
+from service.promptEncoding import encode_catalog, count_tokens
+from service.contextBudget import context_budget
+from service.planParser import PlanParseError, parse_plan, strip_think
+from service.planValidation import validate_plan
+from service.endpointIndex import MOCK_SOURCE_URL, compiled_index, rewrite_origin
+from service.singleFlight import SingleFlight, normalize_query
+from common import tracing
+from service.cascadePlanner import (
+    CASCADE_ENABLED, CASCADE_MODEL, CASCADE_MODEL_THINKS, cascade_stats
+)
 import json
+import logging
 import requests
-import re
 import aiohttp
 import asyncio
 import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+CATALOG_TIMEOUT = float(os.environ.get("CATALOG_TIMEOUT", "30"))
+REGISTRY_TIMEOUT = float(os.environ.get("REGISTRY_TIMEOUT", "10"))
+PLANNER_TIMEOUT = float(os.environ.get("PLANNER_TIMEOUT", "600"))
+# Connect timeout of planner requests, and the longest silence of a streamed
+# generation (the first token includes a cold load). A blocking generation may
+# take up to PLANNER_TIMEOUT. A timeout fails over to the next backend.
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", "120"))
+EXECUTION_TIMEOUT = float(os.environ.get("EXECUTION_TIMEOUT", "60"))
+CONTROL_DEADLINE = float(os.environ.get("CONTROL_DEADLINE", "900"))
+
+# How long Ollama keeps the planner model loaded after a request, so that both the
+# weights and the KV cache of the static prompt prefix survive between requests.
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+COLD_LOAD_SECONDS = float(os.environ.get("LLM_COLD_LOAD_SECONDS", "5"))
+PLAN_REPROMPT_ATTEMPTS = int(os.environ.get("PLAN_REPROMPT_ATTEMPTS", "1"))
+PLAN_REPROMPT_MAX_CHARS = 4000
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+# "off", "plan" (share catalog search and planning, execute per caller) or "full"
+# (share execution too; side-effecting tool calls then run once for all callers).
+SINGLE_FLIGHT = os.environ.get("SINGLE_FLIGHT", "plan").lower()
+
+RESPONSE_MAX_BYTES = int(os.environ.get("TOOL_RESPONSE_MAX_BYTES", str(256 * 1024)))
+RESPONSE_PREVIEW_BYTES = int(os.environ.get("TOOL_RESPONSE_PREVIEW_BYTES", "2048"))
+RESPONSE_CHUNK_SIZE = 64 * 1024
+RESPONSE_SPILL = os.environ.get("TOOL_RESPONSE_SPILL", "true").lower() == "true"
+
+logger = logging.getLogger("control-unit")
+
+PLANNER_EXAMPLE = {
+    "tasks": [
+        {
+            "id": "t1",
+            "task_name": "analyze text",
+            "service_id": "svc-001",
+            "endpoint": "http://svc-001-base-url/analyze",
+            "input": "text to analyze",
+            "operation": "POST",
+            "depends_on": []
+        },
+        {
+            "id": "t2",
+            "task_name": "retrieve report",
+            "service_id": "svc-002",
+            "endpoint": "http://svc-002-base-url/reports/42",
+            "input": "",
+            "operation": "GET",
+            "depends_on": []
+        }
+    ]
+}
+
+# Static instructions, identical byte for byte on every request so that the backend
+# can reuse the KV cache of this prefix; everything request specific goes after it.
+PLANNER_PREFIX = f"""<|system|>
+You have access to a list of services registered in a distributed system:
+- SERVICES, one per line: id | name | description | base URL
+- OPERATIONS, one per line: service id | HTTP method and path | capability
+
+You will receive a query in natural language and must:
+1. Decompose it into atomic tasks.
+2. Associate each task with one or more compatible services based on their capabilities and endpoints.
+3. Return an execution plan.
+
+REPLY ONLY with a valid JSON, WITHOUT any introductory text or comments.
+
+Example of the JSON Response (Make sure to fill the fields with data provided by user):
+TEMPLATE:
+{json.dumps(PLANNER_EXAMPLE)}
+
+RULES:
+- Use only the data provided. Do not make assumptions or invent services or invent endpoints.
+- Be careful with endpoints names and HTTP operations, they must match data provided in OPERATIONS section.
+- The "endpoint" of a task is the base URL of its service followed by the operation path.
+  If an operation lists a full URL instead of a path, use that URL.
+- Endpoints may contain path parameters placeholders in curly brackets
+- You MUST replace these placeholders with actual values extracted from the user query.
+- NEVER return an endpoint containing unresolved placeholders.
+- You have to understand, given the endpoint, if there is a path parameter or a query parameter.
+- Give every task a short unique "id". If a task needs the output of another task, list that task id in "depends_on"
+  and reference the value as {{{{task_id.result.field}}}} in its endpoint or input. Leave "depends_on" empty otherwise.
+- Think about the best way to decompose the query and assign tasks to services.
+<|end|>
+<|user|>
+"""
+
+plan_cache = PlanCache()
+plan_executor = PlanExecutor()
+call_policies = CallPolicies()
+response_cache = ResponseCache()
+blob_store = BlobStore()
+query_flights = SingleFlight()
+
+
+class StageTimeout(Exception):
+    pass
+
 
 class Controller:
 
-    def __init__(self):
+    def __init__(self, on_event=None, priority=0, budget=None, trace_parent=None):
         self.model_name = "phi4-reasoning:14b"
-     
-    def query_ollama(self, prompt: str) -> str:
-        url = os.environ.get("OLLAMA_API_URL", "http://localhost:11434")
+        self.stream = os.environ.get("OLLAMA_STREAM", "true").lower() == "true"
+        self.on_event = on_event
+        self.priority = priority
+        self.budget = min(budget, CONTROL_DEADLINE) if budget else CONTROL_DEADLINE
+        self.cancelled = threading.Event()
+        self.future = None
+        self.endpoint_index = None
+        self.deadline = time.monotonic() + self.budget
+        # Span the pipeline's spans belong to, by default the span of the request creating the controller.
+        self.trace_parent = trace_parent or tracing.current_span()
+
+    def emit(self, event, payload):
+        if self.on_event is not None:
+            self.on_event(event, payload)
+
+    def thinks(self, model):
+        return model == self.model_name or CASCADE_MODEL_THINKS
+
+    def query_ollama(self, prompt: str, model: str = None) -> str:
+        """
+        Sends the prompt to the best backend of the pool, failing over to the
+        next one when a backend is unreachable or rejects the request.
+        """
+        model = model or self.model_name
+        num_ctx = context_budget.context_size(count_tokens(prompt))
+        pool = get_backend_pool()
+        tried = set()
+        error = None
+        while not self.cancelled.is_set():
+            backend = pool.choose(model, exclude=tried, num_ctx=num_ctx)
+            if backend is None:
+                break
+            tried.add(backend.url)
+            if model not in backend.models:
+                logger.info(f"[LLM BACKEND] {model} is not loaded on {backend.url}, expecting a cold load")
+            try:
+                with tracing.span("LLM generate", tracing.CLIENT, **{"llm.model": model, "llm.backend": backend.url}) as span:
+                    queued = time.monotonic()
+                    with get_gateway(backend.url).admit(self.priority, self.deadline, self.cancelled) as admission:
+                        span.set_attribute("llm.admission_wait_ms", round((time.monotonic() - queued) * 1000, 1))
+                        if self.stream:
+                            text = self.query_ollama_stream(backend.url, prompt, model, num_ctx)
+                        else:
+                            text = self.query_ollama_blocking(backend.url, prompt, model, num_ctx)
+                        if not self.cancelled.is_set():
+                            admission.succeed()
+            except BackendUnavailable as e:
+                pool.mark_failed(backend)
+                logger.warning(f"[LLM BACKEND] {backend.url} failed, trying the next backend: {e}")
+                self.emit("failover", {"backend": backend.url, "error": str(e)})
+                error = e
+                continue
+            except AdmissionRejected as e:
+                error = e
+                continue
+            pool.mark_loaded(backend, model, num_ctx)
+            return text
+        if error is None:
+            raise AdmissionRejected("Request cancelled", retry_after=0)
+        raise error
+
+    def generate_request(self, prompt: str, stream: bool, model: str, num_ctx: int) -> dict:
+        span = tracing.current_span()
+        if span is not None:
+            span.set_attribute("llm.num_ctx", num_ctx)
+        options = {"temperature": 0.0, "num_ctx": num_ctx}
+        if not self.thinks(model):
+            # Capping a thinking model cuts its reasoning short and wastes the generation.
+            options["num_predict"] = context_budget.output_tokens
+        return {
+            "model": model,
+            "prompt": prompt,
+            "options": options,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "stream": stream
+        }
+
+    def query_ollama_blocking(self, url: str, prompt: str, model: str, num_ctx: int) -> str:
         try:
-            response = requests.post(
-                f"{url}/api/generate",
-                json={
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "options": {
-                        "temperature": 0.0,
-                        "max_tokens": 4096,
-                        "num_ctx": 8192,
-                    },
-                    
-                    "stream": False
-                }
+            response = get_session().post(
+                f"{url}/api/generate", json=self.generate_request(prompt, False, model, num_ctx), headers=tracing.inject(),
+                timeout=(LLM_CONNECT_TIMEOUT, PLANNER_TIMEOUT)
             )
             response.raise_for_status()
             data = response.json()
+            load_seconds = data.get("load_duration", 0) / 1e9
+            span = tracing.current_span()
+            if span is not None:
+                span.set_attribute("llm.load_seconds", round(load_seconds, 3))
+                span.set_attribute("llm.prompt_tokens", data.get("prompt_eval_count"))
+                span.set_attribute("llm.output_tokens", data.get("eval_count"))
+            if load_seconds > COLD_LOAD_SECONDS:
+                logger.warning(f"[LLM BACKEND] Cold load of {model} on {url} took {load_seconds:.1f}s")
+            if "prompt_eval_count" in data:
+                logger.info(f"[PROMPT] {data['prompt_eval_count']} prompt tokens evaluated by {url} "
+                            f"in {data.get('prompt_eval_duration', 0) / 1e6:.0f} ms")
             return data.get("response", "").strip()
 
+        except requests.exceptions.Timeout as e:
+            raise BackendUnavailable(f"[HTTP TIMEOUT] Timeout nella richiesta a Ollama: {e}")
         except requests.exceptions.RequestException as e:
-            raise RuntimeError(f"[HTTP ERROR] Errore nella richiesta a Ollama: {e}")
+            raise BackendUnavailable(f"[HTTP ERROR] Errore nella richiesta a Ollama: {e}")
         except ValueError:
             raise RuntimeError(f"[PARSE ERROR] Risposta non JSON valida da Ollama: {response.text}")
 
+    def query_ollama_stream(self, url: str, prompt: str, model: str, num_ctx: int) -> str:
+        parser = PlanStreamParser(thinking=self.thinks(model))
+        started = time.monotonic()
+        first_token = None
+        try:
+            with get_session().post(
+                f"{url}/api/generate", json=self.generate_request(prompt, True, model, num_ctx),
+                headers=tracing.inject(), stream=True, timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise BackendUnavailable(f"[HTTP ERROR] Errore nella richiesta a Ollama: {chunk['error']}")
+                    if first_token is None:
+                        # Time to first token is load time plus prefill.
+                        first_token = time.monotonic() - started
+                        span = tracing.current_span()
+                        if span is not None:
+                            span.set_attribute("llm.time_to_first_token_ms", round(first_token * 1000, 1))
+                        if first_token > COLD_LOAD_SECONDS:
+                            logger.warning(f"[LLM BACKEND] First token from {url} after {first_token:.1f}s, likely a cold load")
+                        else:
+                            logger.info(f"[LLM STREAM] First token from {url} after {first_token * 1000:.0f} ms")
+
+                    think_closed = parser.think_end is not None
+                    token = chunk.get("response", "")
+                    self.emit("token", {"text": token})
+                    parser.feed(token)
+                    if not think_closed and parser.think_end is not None:
+                        self.emit("think_end", {"chars": parser.think_end})
+                    if self.cancelled.is_set():
+                        logger.info("[LLM STREAM] Request cancelled, aborting generation")
+                        break
+                    if parser.done:
+                        # Closing the connection makes Ollama abort the remaining generation.
+                        logger.info(f"[LLM STREAM] Plan complete after {len(parser.text)} chars, cancelling generation")
+                        break
+                    if chunk.get("done"):
+                        break
+
+        except requests.exceptions.Timeout as e:
+            raise BackendUnavailable(f"[HTTP TIMEOUT] Timeout nella richiesta a Ollama: {e}")
+        except requests.exceptions.RequestException as e:
+            raise BackendUnavailable(f"[HTTP ERROR] Errore nella richiesta a Ollama: {e}")
+        except ValueError:
+            raise RuntimeError(f"[PARSE ERROR] Risposta non JSON valida da Ollama: {parser.text}")
 
-    def decompose_task(self, discovered_services, discovered_capabilities, discovered_endpoints, query):
+        if parser.done:
+            return parser.text[:parser.plan_end].strip()
+        return parser.text.strip()
 
-        example = {
-        "tasks": [
-            {
-            "task_name": "analyze text",
-            "service_id": "svc-001",
-            "endpoint": "service endpoint",
-            "input": "text to analyze",
-            "operation": "POST"
-            },
-            {
-            "task_name": "retrieve report",
-            "service_id": "svc-002",
-            "endpoint": "service endpoint",
-            "input": "",
-            "operation": "GET"
-            }
-          ]
-        }
 
-        example_str = json.dumps(example)
-        prompt = f"""
-            <|system|>
-            You have access to a list of services registered in a distributed system, each described by:
-            - services
-            - capabilities
-            - endpoints
-
-            You will receive a query in natural language and must:
-            1. Decompose it into atomic tasks.
-            2. Associate each task with one or more compatible services based on their capabilities and endpoints.
-            3. Return an execution plan.
-
-            REPLY ONLY with a valid JSON, WITHOUT any introductory text or comments.
-
-            Example of the JSON Response (Make sure to fille the fields with data provided by user):
-            TEMPLATE:
-            {example_str}
-
-            RULES:
-            - Use only the data provided. Do not make assumptions or invent services or invent endpoints.
-            - Be careful with endpoints names and HTTP operations, they must match date provided in ENDPOINTS section.
-            - Endpoints may contain path parameters placeholders in curly brackets
-            - You MUST replace these placeholders with actual values extracted from the user query.
-            - NEVER return an endpoint containing unresolved placeholders.
-            - You have to understand, given the endpoint, if there is a path parameter or a query parameter.
-            - Think about the best way to decompose the query and assign tasks to services. 
-            <|end|>
-            <|user|>
-            SERVICES:
-            {discovered_services}
-
-            CAPABILITIES:
-            {discovered_capabilities}
-
-            ENDPOINTS:
-            {discovered_endpoints}
-
-            QUERY:
-            {query}
-            <|end|>
-            <|assistant|>
+    def build_prompt(self, discovered_services, discovered_capabilities, discovered_endpoints, query):
         """
-
-        response = self.query_ollama(prompt)
-        print(f"[LLM RESPONSE] {response}")
-        print("="*100)
+        The static PLANNER_PREFIX followed by the variable part. Services are sorted by
+        id so that requests with the same candidates share the longest possible prefix.
+        """
+        ordered = sorted(
+            zip(discovered_services, discovered_capabilities, discovered_endpoints),
+            key=lambda entry: str(entry[0].get("_id"))
+        )
+        services_str, operations_str = encode_catalog(*(list(column) for column in zip(*ordered))) if ordered else ("", "")
+        return PLANNER_PREFIX + f"""SERVICES:
+{services_str}
+
+OPERATIONS:
+{operations_str}
+
+QUERY:
+{query}
+<|end|>
+<|assistant|>
+"""
+
+    def decompose_task(self, prompt, model=None):
+        response = self.query_ollama(prompt, model)
+        logger.debug(f"[LLM RESPONSE] {response}")
         return response
 
-    def extract_agents(self, agents_json):
-        plan = {}
-        json_str = ""
-        try:
-            think_close_match = re.search(r'</think>', agents_json, flags=re.IGNORECASE)
-
-            if think_close_match:
-                after_think = agents_json[think_close_match.end():].strip()
-                start = after_think.find('{')
-                end = after_think.rfind('}') + 1
-
-                if start != -1 and end != -1 and start < end:
-                    json_str = after_think[start:end].strip()
-                    plan = json.loads(json_str)
-                else:
-                    print("[FORMAT ERROR] JSON delimited by { ... } not fount after </think>.")
-            else:
-                print("[FORMAT ERROR] No tag </think> found.")
-        except json.JSONDecodeError as e:
-            print(f"[DECODE ERROR] Errors in JSON parsing: {e}\nExtracted content:\n{json_str}")
-        return plan
+    def plan_query(self, prompt, index):
+        """
+        Returns the execution plan for the prompt. In cascade mode the fast model
+        drafts the plan first; the reasoning model is only asked when the draft
+        fails validation against the candidate services. The draft model is not
+        asked for a confidence score: small models report it unreliably, so
+        validation alone decides the escalation.
+        """
+        if not CASCADE_ENABLED:
+            return self.request_plan(prompt)
 
+        started = time.monotonic()
+        try:
+            draft = self.request_plan(prompt, CASCADE_MODEL)
+            problems = validate_plan(draft, index)
+            outcome = "invalid" if problems else "accepted"
+        except (BackendUnavailable, AdmissionRejected) as e:
+            if self.cancelled.is_set():
+                raise
+            outcome, problems = "draft_error", [str(e)]
+        draft_seconds = time.monotonic() - started
+
+        if outcome == "accepted":
+            cascade_stats.record(outcome, draft_seconds)
+            logger.info(f"[CASCADE] Draft of {CASCADE_MODEL} accepted after {draft_seconds:.1f}s")
+            return draft
+
+        logger.info(f"[CASCADE] Escalating to {self.model_name} ({outcome}): {'; '.join(problems)}")
+        self.emit("escalate", {"reason": outcome, "problems": problems})
+        started = time.monotonic()
+        try:
+            return self.request_plan(prompt)
+        finally:
+            cascade_stats.record(outcome, draft_seconds, time.monotonic() - started)
 
+    def request_plan(self, prompt, model=None):
+        """
+        Asks the model for a plan. Defects the parser cannot repair locally are sent
+        back to the model, at most PLAN_REPROMPT_ATTEMPTS times, as a follow-up turn
+        that keeps the original prompt as prefix.
+        """
+        thinking = self.thinks(model or self.model_name)
+        response = self.decompose_task(prompt, model)
+        for attempt in range(PLAN_REPROMPT_ATTEMPTS + 1):
+            try:
+                plan, repairs = parse_plan(response, thinking)
+            except PlanParseError as e:
+                if attempt == PLAN_REPROMPT_ATTEMPTS or self.cancelled.is_set():
+                    logger.warning(f"[FORMAT ERROR] No valid plan in the LLM response: {e}")
+                    return {}
+                logger.warning(f"[FORMAT ERROR] {e}, asking the model to correct its reply")
+                self.emit("reprompt", {"error": str(e)})
+                prompt = (
+                    f"{prompt}{strip_think(response)[-PLAN_REPROMPT_MAX_CHARS:]}\n<|end|>\n<|user|>\n"
+                    f"Your reply is not a valid execution plan: {e}.\n"
+                    f"Reply ONLY with the corrected JSON plan.\n<|end|>\n<|assistant|>\n"
+                )
+                response = self.decompose_task(prompt, model)
+                continue
+            if repairs:
+                logger.info(f"[PLAN REPAIR] {', '.join(dict.fromkeys(repairs))}")
+            return plan
+
+    async def read_body(self, resp):
+        """
+        Reads at most RESPONSE_MAX_BYTES of the body. Larger bodies are reported
+        with truncation metadata and, if RESPONSE_SPILL is set, streamed to the blob store.
+        """
+        body = bytearray()
+        async for chunk in resp.content.iter_chunked(RESPONSE_CHUNK_SIZE):
+            body.extend(chunk)
+            if len(body) > RESPONSE_MAX_BYTES:
+                break
+        else:
+            return bytes(body), None
+
+        truncation = {
+            "truncated": True,
+            "limit": RESPONSE_MAX_BYTES,
+            "content_type": resp.content_type,
+            "preview": body[:RESPONSE_PREVIEW_BYTES].decode(resp.charset or "utf-8", errors="replace"),
+        }
+        size = len(body)
+        if RESPONSE_SPILL:
+            blob_id, handle = await asyncio.to_thread(blob_store.create)
+            try:
+                await asyncio.to_thread(handle.write, bytes(body))
+                async for chunk in resp.content.iter_chunked(RESPONSE_CHUNK_SIZE):
+                    if size + len(chunk) > blob_store.max_bytes:
+                        truncation["blob_truncated"] = True
+                        break
+                    size += len(chunk)
+                    await asyncio.to_thread(handle.write, chunk)
+            finally:
+                await asyncio.to_thread(handle.close)
+            truncation["blob_id"] = blob_id
+        truncation["size"] = size
+        return None, truncation
+
+    async def send_request(self, session, operation, endpoint, input_data, timeout):
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout), "headers": tracing.inject()}
+        if operation in ("POST", "PUT"):
+            kwargs["json"] = input_data
+
+        async with session.request(operation, endpoint, **kwargs) as resp:
+            success_codes = (200,) if operation == "GET" else (200, 201, 204)
+            ok = resp.status in success_codes
+            body, truncation = await self.read_body(resp)
+            if truncation is not None:
+                return resp.status, ok, truncation
+
+            text = body.decode(resp.charset or "utf-8", errors="replace")
+            if not ok or operation == "DELETE" or not text:
+                return resp.status, ok, text
+            try:
+                return resp.status, ok, json.loads(text)
+            except ValueError:
+                return resp.status, ok, text
 
     async def call_agent(self, session, task, discovered_services):
+        """
+        Runs one task of the plan in its own span.
+        """
+        attributes = {
+            "task.id": task.get("id"),
+            "task.name": task.get("task_name"),
+            "service.id": task.get("service_id"),
+            "http.request.method": task.get("operation"),
+        }
+        with tracing.span("Task", tracing.CLIENT, **{k: str(v) for k, v in attributes.items() if v is not None}) as span:
+            result = await self.run_task(session, task, discovered_services)
+            span.set_attribute("task.status", result.get("status"))
+            span.set_attribute("http.response.status_code", result.get("status_code"))
+            span.set_attribute("task.attempts", result.get("attempts"))
+            span.set_attribute("task.cache", result.get("cache"))
+            if result.get("status") not in (None, "SUCCESS"):
+                span.set_error(result["status"])
+            return result
+
+    async def run_task(self, session, task, discovered_services):
         task_name = task.get("task_name")
         service_id = task.get("service_id")
         endpoint = task.get("endpoint")
@@ -141,200 +465,448 @@ class Controller:
 
         response_result = {}
         response_result['operation'] = operation
-
-        match operation:
-            case "POST":
-                try:
-                    async with session.post(endpoint, json=input_data, timeout=5) as resp:
-                        if resp.status == 200 or resp.status == 201 or resp.status == 204:
-                            result = await resp.json()
-                            print(f"[SUCCESS] Task '{task_name}' completed: {result}")
-                            response_result["status"] = "SUCCESS"
-                            response_result["status_code"] = resp.status
-                            response_result["task_name"] = task_name
-                            response_result["result"] = result
-
-                        else:
-                            error_text = await resp.text()
-                            print(f"[ERROR] Task '{task_name}' failed with status {resp.status}: {error_text}")
-                            response_result["status"] = "ERROR"
-                            response_result["status_code"] = resp.status
-                            response_result["task_name"] = task_name
-                            response_result["result"] = error_text
-                except Exception as e:
-                    print(f"[EXCEPTION] Error in task: '{task_name}' → {e}")
-                    response_result["status"] = "EXCEPTION"
-                    response_result["status_code"] = 500
-                    response_result["task_name"] = task_name
-                    response_result["result"] = str(e)
-            case "GET":
-                try:
-                    async with session.get(endpoint, timeout=5) as resp:
-                        if resp.status == 200:
-                            result = await resp.json()
-                            print(f"[SUCCESS] Task '{task_name}' completed: {result}")
-                            response_result["status"] = "SUCCESS"
-                            response_result["status_code"] = resp.status
-                            response_result["task_name"] = task_name
-                            response_result["result"] = result
-                        else:
-                            error_text = await resp.text()
-                            print(f"[ERROR] Task '{task_name}' failed with status {resp.status}: {error_text}")
-                            response_result["status"] = "ERROR"
-                            response_result["status_code"] = resp.status
-                            response_result["task_name"] = task_name
-                            response_result["result"] = error_text
-                except Exception as e:
-                    print(f"[EXCEPTION] Error in task: '{task_name}' → {e}")
-                    response_result["status"] = "EXCEPTION"
-                    response_result["status_code"] = 500
-                    response_result["task_name"] = task_name
-                    response_result["result"] = str(e)
-            case "DELETE":
-                try:
-                    async with session.delete(endpoint, timeout=5) as resp:
-                        if resp.status == 200 or resp.status == 201 or resp.status == 204:
-                            result = await resp.text()
-                            print(f"[SUCCESS] Task '{task_name}' completed: {result}")
-                            response_result["status"] = "SUCCESS"
-                            response_result["status_code"] = resp.status
-                            response_result["task_name"] = task_name
-                            response_result["result"] = result
-                        else:
-                            error_text = await resp.text()
-                            print(f"[ERROR] Task '{task_name}' failed with status {resp.status}: {error_text}")
-                            response_result["status"] = "ERROR"
-                            response_result["status_code"] = resp.status
-                            response_result["task_name"] = task_name
-                            response_result["result"] = error_text
-                except Exception as e:
-                    print(f"[EXCEPTION] Error in task: '{task_name}' → {e}")
-                    response_result["status"] = "EXCEPTION"
-                    response_result["status_code"] = 500
-                    response_result["task_name"] = task_name
-                    response_result["result"] = str(e)
-            case "PUT":
+        response_result["task_name"] = task_name
+
+        if operation not in ("GET", "POST", "PUT", "DELETE"):
+            return response_result
+
+        # Breakers and latencies are tracked per operation of the service, not per concrete URL.
+        key = f"{service_id} {operation} {urlsplit(endpoint).path}"
+        if self.endpoint_index is not None:
+            match = self.endpoint_index.match(service_id, operation, endpoint)
+            if match is None:
+                logger.warning(f"[INVALID TASK] Task '{task_name}': {operation} {endpoint} is not an operation of {service_id}")
+                response_result["status"] = "INVALID"
+                response_result["status_code"] = None
+                response_result["result"] = f"{operation} {endpoint} is not an operation of {service_id}"
+                return response_result
+            endpoint, operation_key = match
+            key = f"{service_id} {operation_key}"
+
+        policy = call_policies.for_service(service_id)
+        breaker = call_policies.breaker(key, policy)
+        latency = call_policies.latency(key)
+
+        if not breaker.allow():
+            logger.warning(f"[CIRCUIT OPEN] Task '{task_name}' not sent to {endpoint}")
+            response_result["status"] = "CIRCUIT_OPEN"
+            response_result["status_code"] = 503
+            response_result["result"] = f"Circuit open for {key}"
+            return response_result
+
+        def send():
+            return self.send_request(session, operation, endpoint, input_data, policy.timeout)
+
+        def fetch():
+            if policy.hedge:
+                return call_policies.hedged(send, key, policy)
+            return send()
+
+        probe = breaker.probing
+        try:
+            attempts = policy.retries + 1 if operation in IDEMPOTENT_OPERATIONS else 1
+            for attempt in range(attempts):
+                started = time.monotonic()
                 try:
-                    async with session.put(endpoint, json=input_data, timeout=5) as resp:
-                        if resp.status == 200 or resp.status == 201 or resp.status == 204:
-                            result = await resp.json()
-                            print(f"[SUCCESS] Task '{task_name}' completed: {result}")
-                            response_result["status"] = "SUCCESS"
-                            response_result["status_code"] = resp.status
-                            response_result["task_name"] = task_name
-                            response_result["result"] = result
-                        else:
-                            error_text = await resp.text()
-                            print(f"[ERROR] Task '{task_name}' failed with status {resp.status}: {error_text}")
-                            response_result["status"] = "ERROR"
-                            response_result["status_code"] = resp.status
-                            response_result["task_name"] = task_name
-                            response_result["result"] = error_text
+                    if operation == "GET":
+                        (status_code, ok, result), source = await response_cache.fetch(service_id, endpoint, fetch)
+                        if source != "origin":
+                            response_result["cache"] = source
+                    else:
+                        try:
+                            status_code, ok, result = await send()
+                        finally:
+                            response_cache.invalidate(endpoint)
+                        source = "origin"
+                    # Cache hits and coalesced GETs would skew the hedging percentile.
+                    if source == "origin":
+                        latency.record(time.monotonic() - started)
                 except Exception as e:
-                    print(f"[EXCEPTION] Error in task: '{task_name}' → {e}")
+                    logger.warning(f"[EXCEPTION] Error in task: '{task_name}' → {e}")
                     response_result["status"] = "EXCEPTION"
                     response_result["status_code"] = 500
-                    response_result["task_name"] = task_name
                     response_result["result"] = str(e)
+                    retryable = True
+                else:
+                    if ok:
+                        logger.debug(f"[SUCCESS] Task '{task_name}' completed with status {status_code}")
+                        response_result["status"] = "SUCCESS"
+                    else:
+                        logger.info(f"[ERROR] Task '{task_name}' failed with status {status_code}")
+                        response_result["status"] = "ERROR"
+                    response_result["status_code"] = status_code
+                    response_result["result"] = result
+                    retryable = status_code >= 500
+
+                response_result["attempts"] = attempt + 1
+                if not retryable:
+                    breaker.record_success()
+                    break
+                breaker.record_failure()
+                if attempt + 1 < attempts and breaker.allow():
+                    await asyncio.sleep(policy.backoff_delay(attempt))
+                else:
+                    break
+        finally:
+            if probe:
+                # A cancelled probe records neither outcome; let the next call probe instead.
+                breaker.release_probe()
 
         return response_result
 
-        
     async def trigger_agents_async(self, agents: dict, discovered_services):
         tasks = agents.get("tasks", [])
-        async with aiohttp.ClientSession() as session:
-            futures = [asyncio.create_task(self.call_agent(session, task, discovered_services)) for task in tasks]
-            results = await asyncio.gather(*futures)
+        session = await get_runner().client()
+        results = await plan_executor.run(
+            tasks,
+            lambda task: self.call_agent(session, task, discovered_services),
+            on_result=lambda result: self.emit("task_result", result),
+            host_of=self.task_host
+        )
         return results
 
-    def trigger_agents(self, agents: dict, discovered_services):
-        results = asyncio.run(self.trigger_agents_async(agents, discovered_services))
-        return results
+    def task_host(self, task):
+        """
+        The host a task is sent to: the catalog origin of its operation, whatever
+        host the planner wrote in the endpoint.
+        """
+        if self.endpoint_index is not None and isinstance(task.get("endpoint"), str):
+            match = self.endpoint_index.match(
+                task.get("service_id"), str(task.get("operation", "")).upper(), task["endpoint"]
+            )
+            if match is not None:
+                return urlsplit(match[0]).netloc
+        return plan_executor.endpoint_host(task)
 
+    def catalog_budget(self, query):
+        """
+        Token budget to request candidates for: what the largest context leaves
+        next to the prompt without any service, in the gateway's token units.
+        """
+        return context_budget.catalog_request(count_tokens(self.build_prompt([], [], [], query)))
 
-    def replace_endpoints(self, endpoints_list, mock_server_address):
-        updated = []
-        for endpoint_dict in endpoints_list:
-            new_dict = {}
-            for k, v in endpoint_dict.items():
-                if isinstance(v, str):
-                    new_url = re.sub(r"http://localhost:8585", mock_server_address, v)
-                    new_dict[k] = new_url
-                else:
-                    new_dict[k] = v
-            updated.append(new_dict)
-        return updated
+    async def search_catalog(self, query):
+        catalog_url = os.environ.get("CATALOG_URL")
+
+        input = {
+            "query": query,
+            "max_tokens": self.catalog_budget(query),
+            "return_embedding": plan_cache.semantic
+        }
+        session = await get_runner().client()
+        async with session.post(f"{catalog_url}/index/search", json=input, headers=tracing.inject()) as resp:
+            service_data = await resp.json()
 
+        # Candidate preprocessing overlaps with the registry lookup.
+        return self.prepare_candidates(service_data)
 
-    def control(self, query):
-        catalog_url = os.environ.get("CATALOG_URL")
-        registry = Discovery(os.environ.get("REGISTRY_URL"))
+    @staticmethod
+    def prepare_candidates(service_data):
         mock_server_address = os.environ.get("MOCK_SERVER_URL")
+        register_key = "POST /register"
 
-        discovered_services = []
-        discovered_capabilities = []
-        discovered_endpoints = []
+        service_list = service_data["results"]
+        for service in service_list:
+            if isinstance(service.get("capabilities"), dict):
+                service["capabilities"].pop(register_key, None)
 
-        services = registry.services()
+            if isinstance(service.get("endpoints"), dict):
+                service["endpoints"].pop(register_key, None)
+                service["endpoints"] = {
+                    key: rewrite_origin(url, MOCK_SOURCE_URL, mock_server_address)
+                    for key, url in service["endpoints"].items()
+                }
 
-        register_key = "POST /register"
-        print("DISCOVERED SERVICES:")
+        if service_list and service_data.get("tokens"):
+            context_budget.observe_catalog(service_data["tokens"], count_tokens("\n".join(encode_catalog(
+                [Controller.preamble(s) for s in service_list],
+                [s.get("capabilities", {}) for s in service_list],
+                [s.get("endpoints", {}) for s in service_list]
+            ))))
+        return service_list, service_data.get("query_embedding")
 
-        input = {
-            "query": query
+    @staticmethod
+    def preamble(service):
+        return {
+            "_id": service.get("_id"),
+            "name": service.get("name"),
+            "description": service.get("description"),
         }
-        service_data = requests.post(f"{catalog_url}/index/search", json=input)
-        service_data = service_data.json()
-        service_list = service_data["results"]
+
+    def fit_prompt(self, services, query):
+        """
+        Builds the planner prompt of the candidate services, given in rank order,
+        dropping the lowest ranked ones while it does not fit the largest context.
+        The encoded lines of each service are counted once and subtracted, so the
+        whole prompt is only tokenized again to confirm the result.
+        Returns (services kept, prompt, prompt tokens).
+        """
+        kept = list(services)
+        costs = None
+        while True:
+            prompt = self.build_prompt(
+                [self.preamble(s) for s in kept],
+                [s.get("capabilities", {}) for s in kept],
+                [s.get("endpoints", {}) for s in kept],
+                query
+            )
+            prompt_tokens = count_tokens(prompt)
+            if prompt_tokens <= context_budget.max_prompt_tokens or len(kept) <= 1:
+                return kept, prompt, prompt_tokens
+            if costs is None:
+                costs = [
+                    count_tokens("\n".join(encode_catalog(
+                        [self.preamble(s)], [s.get("capabilities", {})], [s.get("endpoints", {})]
+                    )) + "\n")
+                    for s in kept
+                ]
+            excess = prompt_tokens - context_budget.max_prompt_tokens
+            while excess > 0 and len(kept) > 1:
+                kept.pop()
+                excess -= costs.pop()
+
+    async def registry_ids(self):
+        registry = get_registry(os.environ.get("REGISTRY_URL"))
+        if registry.synced():
+            # In-memory snapshot kept fresh by the watches: no need to leave the loop.
+            return registry.available_ids()
+        return await get_runner().run_blocking(registry.available_ids)
+
+    async def run_stage(self, name, awaitable, stage_timeout):
+        """
+        Awaits a pipeline stage bounded by its own timeout and by the overall deadline.
+        """
+        remaining = max(0.0, min(stage_timeout, self.deadline - time.monotonic()))
+        with tracing.span(name):
+            try:
+                return await asyncio.wait_for(awaitable, remaining)
+            except asyncio.TimeoutError:
+                raise StageTimeout(name)
+
+    def failure(self, error):
+        return {
+            "execution_plan": {},
+            "execution_results": [],
+            "error": error
+        }
+
+    @staticmethod
+    async def prefetched(value):
+        return value
+
+    async def control_async(self, query, catalog=None):
+        """
+        Runs the whole pipeline for a query. `catalog` is an already fetched
+        (service_list, query_embedding) pair, e.g. from a batched catalog search.
+        Identical queries in flight at the same time share one planning run
+        (SINGLE_FLIGHT=plan) or one planning and execution run (SINGLE_FLIGHT=full).
+        Each caller waits for a shared run at most until its own deadline.
+        """
+        self.deadline = time.monotonic() + self.budget
+        if SINGLE_FLIGHT not in ("full", "plan"):
+            return await self.run_pipeline(query, catalog)
+
+        if SINGLE_FLIGHT == "full":
+            name, work = "Shared pipeline", lambda c: c.run_pipeline(query, catalog)
+        else:
+            name, work = "Shared planning", lambda c: c.plan_async(query, catalog)
+        try:
+            # The flight is shielded: timing out only detaches this caller.
+            shared = await self.run_stage(name, query_flights.run(
+                (SINGLE_FLIGHT, normalize_query(query)), self.spawn, work, self.emit, self.join
+            ), CONTROL_DEADLINE)
+        except StageTimeout as e:
+            return self.failure(f"{e} timed out")
+        if SINGLE_FLIGHT == "full":
+            return shared
+
+        planned, failure = shared
+        if failure is not None:
+            return failure
+        self.endpoint_index = planned["endpoint_index"]
+        return await self.execute_async(planned)
+
+    def spawn(self, on_event):
+        """
+        A controller with the same priority and budget, running work shared by several callers.
+        """
+        return Controller(on_event=on_event, priority=self.priority, budget=self.budget)
+
+    def join(self, shared):
+        """
+        Raises the controller of a flight this request waits on to the highest
+        priority (lowest number) and the latest deadline of its waiters.
+        """
+        shared.priority = min(shared.priority, self.priority)
+        shared.budget = max(shared.budget, self.budget)
+        shared.deadline = max(shared.deadline, self.deadline)
+
+    async def run_pipeline(self, query, catalog=None):
+        planned, failure = await self.plan_async(query, catalog)
+        if failure is not None:
+            return failure
+        return await self.execute_async(planned)
+
+    async def plan_async(self, query, catalog=None):
+        """
+        Catalog search, registry filtering and planning. Returns (planned, None)
+        or (None, failure).
+        """
+        self.deadline = time.monotonic() + self.budget
+
+        search = self.search_catalog(query) if catalog is None else self.prefetched(catalog)
+        catalog_stage = asyncio.ensure_future(self.run_stage("Catalog search", search, CATALOG_TIMEOUT))
+        registry_stage = asyncio.ensure_future(self.run_stage("Registry lookup", self.registry_ids(), REGISTRY_TIMEOUT))
+        try:
+            (service_list, query_embedding), registry_service_ids = await asyncio.gather(catalog_stage, registry_stage)
+        except StageTimeout as e:
+            return None, self.failure(f"{e} timed out")
+        finally:
+            catalog_stage.cancel()
+            registry_stage.cancel()
 
         if not service_list:
-            return {
-                "execution_plan": {},
-                "execution_results": [],
-                "error": "No services matched the query"
-            }
-        
-        registry_service_ids = set(s["id"] for s in services)
+            return None, self.failure("No services matched the query")
+
         filtered_service_list = [s for s in service_list if s["_id"] in registry_service_ids]
         orphaned_services = [s for s in service_list if s["_id"] not in registry_service_ids]
         if orphaned_services:
-            print("[WARNING] Services found via semantic search but are no longer in the registry:")
-            for s in orphaned_services:
-                print(f"- {s.get('_id')} : {s.get('name')}")
+            logger.warning("[WARNING] Services found via semantic search but are no longer in the registry: "
+                           + ", ".join(f"{s.get('_id')} ({s.get('name')})" for s in orphaned_services))
 
         if not filtered_service_list:
+            return None, self.failure("None of the discovered services are currently available in the registry")
+
+        candidates = len(filtered_service_list)
+        filtered_service_list, prompt, prompt_tokens = self.fit_prompt(filtered_service_list, query)
+        if len(filtered_service_list) < candidates:
+            logger.warning(f"[PROMPT] Dropped the {candidates - len(filtered_service_list)} lowest ranked services "
+                           f"to fit {context_budget.max_prompt_tokens} prompt tokens")
+        for service in filtered_service_list:
+            logger.debug(f"[DISCOVERED SERVICE] {service}")
+        discovered_services = [self.preamble(s) for s in filtered_service_list]
+
+        self.emit("services", {"services": [s["_id"] for s in discovered_services]})
+        self.endpoint_index = compiled_index(filtered_service_list)
+        logger.info(f"[PROMPT] {len(filtered_service_list)} services, {len(prompt)} chars, {prompt_tokens} tokens")
+        self.emit("prompt", {"chars": len(prompt), "tokens": prompt_tokens})
+
+        service_key = plan_cache.service_key(filtered_service_list)
+        plan, cache_tier = plan_cache.get(prompt, query, query_embedding, service_key)
+        if plan is None:
+            try:
+                plan = await self.run_stage(
+                    "Planner",
+                    get_runner().run_planning(self.plan_query, prompt, self.endpoint_index),
+                    PLANNER_TIMEOUT
+                )
+            except StageTimeout as e:
+                self.cancelled.set()
+                return None, self.failure(f"{e} timed out")
+            plan_cache.put(prompt, query, query_embedding, service_key, plan)
+        else:
+            logger.info(f"[PLAN CACHE] {cache_tier} hit for query: {query}")
+        self.emit("plan", plan)
+        return {
+            "plan": plan,
+            "discovered_services": discovered_services,
+            "endpoint_index": self.endpoint_index,
+            "cache_tier": cache_tier,
+            "prompt_tokens": prompt_tokens
+        }, None
+
+    async def execute_async(self, planned):
+        plan = planned["plan"]
+        try:
+            results = await self.run_stage("Plan execution", self.trigger_agents_async(plan, planned["discovered_services"]), EXECUTION_TIMEOUT)
+        except StageTimeout as e:
             return {
-                "execution_plan": {},
+                "execution_plan": plan,
                 "execution_results": [],
-                "error": "None of the discovered services are currently available in the registry"
+                "plan_cache": planned["cache_tier"],
+                "prompt_tokens": planned["prompt_tokens"],
+                "error": f"{e} timed out"
             }
-        
-        for service in filtered_service_list:
-            if isinstance(service.get("capabilities"), dict):
-                service["capabilities"].pop(register_key, None)
+        return {
+            "execution_plan": plan,
+            "execution_results": results,
+            "plan_cache": planned["cache_tier"],
+            "prompt_tokens": planned["prompt_tokens"]
+        }
 
-            if isinstance(service.get("endpoints"), dict):
-                service["endpoints"].pop(register_key, None)
+    def control(self, query):
+        self.future = get_runner().submit(tracing.bound(self.control_async(query), self.trace_parent))
+        if self.cancelled.is_set():
+            self.future.cancel()
+        return self.future.result()
+
+    def cancel(self):
+        """
+        Aborts a running control() call: stops the LLM stream and cancels pending tool calls.
+        """
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class BatchController:
+    """
+    Runs many queries as one batch: a single batched catalog search for all of
+    them, then at most BATCH_CONCURRENCY pipelines at a time on the shared event
+    loop, sharing its connection pool and the LLM admission gateway.
+    on_result(index, query, result) is called as each query finishes.
+    """
+
+    def __init__(self, queries, on_result=None, priority=0, budget=None):
+        self.queries = queries
+        self.on_result = on_result
+        self.controllers = [Controller(priority=priority, budget=budget) for _ in queries]
+        self.trace_parent = tracing.current_span()
+        self.future = None
+
+    async def search_catalog_batch(self):
+        catalog_url = os.environ.get("CATALOG_URL")
+        input = {
+            "queries": self.queries,
+            "max_tokens": [controller.catalog_budget(query) for controller, query in zip(self.controllers, self.queries)],
+            "return_embedding": plan_cache.semantic
+        }
+        session = await get_runner().client()
+        async with session.post(f"{catalog_url}/index/search/batch", json=input, headers=tracing.inject()) as resp:
+            resp.raise_for_status()
+            batch = await resp.json()
+        return [Controller.prepare_candidates(service_data) for service_data in batch["results"]]
 
+    async def run_async(self):
+        try:
+            catalogs = await asyncio.wait_for(self.search_catalog_batch(), CATALOG_TIMEOUT)
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+            # Fall back to one catalog search per query.
+            logger.warning(f"[BATCH] Batched catalog search failed, searching per query: {e}")
+            catalogs = [None] * len(self.queries)
 
-            print(service)
-            print("="*100)
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
 
-            service_preamble = {
-                "_id": service.get("_id"),
-                "name": service.get("name"),
-                "description": service.get("description"),
-            }
-            discovered_services.append(service_preamble)
-            discovered_capabilities.append(service.get("capabilities", {}))
-            discovered_endpoints.append(service.get("endpoints", {}))
-        
-        discovered_endpoints = self.replace_endpoints(discovered_endpoints, mock_server_address)
-        plan_json = self.decompose_task(discovered_services, discovered_capabilities, discovered_endpoints, query)
-        plan = self.extract_agents(plan_json)
-
-        results = self.trigger_agents(plan, discovered_services)
-        return {
-            "execution_plan": plan,
-            "execution_results": results
-        }
+        async def run_one(index):
+            async with semaphore:
+                try:
+                    result = await self.controllers[index].control_async(self.queries[index], catalogs[index])
+                except Exception as e:
+                    result = self.controllers[index].failure(str(e))
+            if self.on_result is not None:
+                self.on_result(index, self.queries[index], result)
+            return result
+
+        return await asyncio.gather(*(run_one(index) for index in range(len(self.queries))))
+
+    def run(self):
+        self.future = get_runner().submit(tracing.bound(self.run_async(), self.trace_parent))
+        if any(controller.cancelled.is_set() for controller in self.controllers):
+            self.future.cancel()
+        return self.future.result()
+
+    def cancel(self):
+        for controller in self.controllers:
+            controller.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
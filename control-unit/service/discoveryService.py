@@ -1,36 +1,169 @@
-import requests
-import json
+import logging
+import os
+import threading
+import time
+from service.httpPool import get_session
 
-class Discovery:
-    _instance = None
+HEALTH_SEVERITY = {"passing": 0, "warning": 1, "critical": 2}
 
+logger = logging.getLogger("control-unit")
+
+
+def parse_services(services_data):
+    services_list = []
+    for service_id, service_info in services_data.items():
+        meta = service_info.get('Meta', {})
+        catalog_id = meta.get('service_doc_id', {})
+
+        service = {
+            "id": service_info['ID'],
+            "service": service_info['Service'],
+            "catalog_id": catalog_id,
+        }
+        services_list.append(service)
+
+    return services_list
+
+
+class RegistryWatcher:
     """
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(Discovery, cls).__new__(cls)
-        return cls._instance
+    In-memory snapshot of the registry, kept fresh by Consul blocking queries.
+    /v1/agent/services is watched with hash-based blocking (the agent endpoints
+    do not return an index), /v1/health/state/any with ?index= long-polling.
     """
 
     def __init__(self, address):
+        self.registry_address = address
+        self.wait = int(os.environ.get("REGISTRY_WATCH_WAIT", "55"))
+        self.ready_timeout = float(os.environ.get("REGISTRY_READY_TIMEOUT", "5"))
+        self.exclude_critical = os.environ.get("REGISTRY_EXCLUDE_CRITICAL", "true").lower() == "true"
+
+        self._services = []
+        self._ids = frozenset()
+        self._available_ids = frozenset()
+        self._health = {}
+        self._services_synced = threading.Event()
+        self._health_synced = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+
+        watches = (
+            ("/v1/agent/services", "hash", "X-Consul-ContentHash", self._apply_services),
+            ("/v1/health/state/any", "index", "X-Consul-Index", self._apply_health),
+        )
+        for path, token_param, token_header, apply in watches:
+            threading.Thread(
+                target=self._watch,
+                args=(path, token_param, token_header, apply),
+                name=f"registry-watch{path.replace('/', '-')}",
+                daemon=True
+            ).start()
+        return self
+
+    def _fetch(self, path, params=None):
+        response = get_session().get(f"{self.registry_address}{path}", params=params, timeout=self.wait + 10)
+        response.raise_for_status()
+        return response
+
+    def _watch(self, path, token_param, token_header, apply):
+        token = None
+        backoff = 1
+        while True:
+            params = {"wait": f"{self.wait}s"}
+            if token is not None:
+                params[token_param] = token
+            try:
+                response = self._fetch(path, params)
+                new_token = response.headers.get(token_header)
+                if token_param == "index" and new_token and token and int(new_token) < int(token):
+                    # Consul index went backwards (e.g. agent restart): start over.
+                    new_token = None
+                apply(response.json())
+                token = new_token
+                backoff = 1
+            except Exception as e:
+                # Warn once per outage; the retries that follow are only logged at debug level.
+                log = logger.warning if backoff == 1 else logger.debug
+                log(f"[REGISTRY WATCH] {path} failed: {e}. Retrying in {backoff}s")
+                token = None
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _apply_services(self, services_data):
+        services = parse_services(services_data)
+        with self._lock:
+            self._services = services
+            self._ids = frozenset(s["id"] for s in services)
+            self._rebuild_available()
+        self._services_synced.set()
+
+    def _apply_health(self, checks):
+        health = {}
+        for check in checks:
+            service_id = check.get("ServiceID")
+            if not service_id:
+                continue
+            status = check.get("Status", "passing")
+            if HEALTH_SEVERITY.get(status, 0) >= HEALTH_SEVERITY.get(health.get(service_id, "passing"), 0):
+                health[service_id] = status
+        with self._lock:
+            self._health = health
+            self._rebuild_available()
+        self._health_synced.set()
+
+    def _rebuild_available(self):
+        if self.exclude_critical:
+            self._available_ids = frozenset(i for i in self._ids if self._health.get(i) != "critical")
+        else:
+            self._available_ids = self._ids
+
+    def refresh(self):
         """
-        Inizializza la classe con i dati di connessione.
+        Synchronous fetch of both views, used until the watches have synced once.
         """
-        self.registry_address = address
+        self._apply_services(self._fetch("/v1/agent/services").json())
+        self._apply_health(self._fetch("/v1/health/state/any").json())
+
+    def synced(self):
+        return self._services_synced.is_set() and self._health_synced.is_set()
+
+    def _ensure_synced(self):
+        if self.synced():
+            return
+        if not (self._services_synced.wait(self.ready_timeout) and self._health_synced.wait(self.ready_timeout)):
+            self.refresh()
 
     def services(self):
-        response = requests.get(f"{self.registry_address}/v1/agent/services")
-        services_data = response.json()
-
-        services_list = []
-        for service_id, service_info in services_data.items():
-            meta = service_info.get('Meta', {})
-            catalog_id = meta.get('service_doc_id', {})
-
-            service = {
-                "id": service_info['ID'],
-                "service": service_info['Service'],
-                "catalog_id": catalog_id,
-            }
-            services_list.append(service)
-
-        return services_list
+        self._ensure_synced()
+        return list(self._services)
+
+    def ids(self):
+        self._ensure_synced()
+        return self._ids
+
+    def health(self, service_id):
+        self._ensure_synced()
+        return self._health.get(service_id, "passing")
+
+    def available_ids(self):
+        self._ensure_synced()
+        return self._available_ids
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_registry(address):
+    global _watcher
+    if _watcher is None:
+        with _watcher_lock:
+            if _watcher is None:
+                _watcher = RegistryWatcher(address).start()
+    return _watcher
@@ -0,0 +1,130 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+TEMPLATE_PARAMETER = re.compile(r"^\{[^{}/]+\}$")
+PLACEHOLDER = re.compile(r"\{[^{}/]*\}")
+MOCK_SOURCE_URL = os.environ.get("MOCK_SOURCE_URL", "http://localhost:8585")
+INDEX_CACHE_SIZE = int(os.environ.get("ENDPOINT_INDEX_CACHE_SIZE", "256"))
+
+
+def rewrite_origin(url, source, target):
+    """
+    Replaces the `source` prefix of a catalog URL with `target`, e.g. the host the
+    importer registered with the address the mock server is reachable at.
+    """
+    if target and isinstance(url, str) and url.startswith(source):
+        return target.rstrip("/") + url[len(source):]
+    return url
+
+
+def _segments(path):
+    return [segment for segment in path.split("/") if segment]
+
+
+class _Node:
+    __slots__ = ("children", "parameter", "operation")
+
+    def __init__(self):
+        self.children = {}
+        self.parameter = None
+        self.operation = None
+
+
+class EndpointIndex:
+    """
+    Path-template trie of the operations of a set of services, one trie per
+    (service id, method). Literal segments are compared URL-decoded, template
+    parameters match any single concrete segment. match() walks the trie in
+    O(path length) and returns the canonical URL of the task: the service's own
+    origin and literal segments, the concrete parameter values and query string.
+    """
+
+    def __init__(self, services):
+        self._roots = {}
+        self.services = set()
+        for service in services:
+            for key, url in (service.get("endpoints") or {}).items():
+                if isinstance(url, str):
+                    self.add(service.get("_id"), key, url)
+
+    def __deepcopy__(self, memo):
+        # Never modified after construction, so copies can share it.
+        return self
+
+    def add(self, service_id, key, url):
+        method = key.partition(" ")[0].upper()
+        parts = urlsplit(url)
+        self.services.add(service_id)
+        node = self._roots.setdefault((service_id, method), _Node())
+        for segment in _segments(parts.path):
+            if TEMPLATE_PARAMETER.match(segment):
+                node.parameter = node.parameter or _Node()
+                node = node.parameter
+            else:
+                node = node.children.setdefault(unquote_plus(segment), _Node())
+        node.operation = (key, parts.scheme, parts.netloc, _segments(parts.path))
+
+    def _walk(self, node, segments, position):
+        if position == len(segments):
+            return node.operation
+        segment = unquote_plus(segments[position])
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._walk(child, segments, position + 1)
+            if found is not None:
+                return found
+        # Decoded first, so an encoded placeholder such as %7Bid%7D is rejected too.
+        if node.parameter is not None and not PLACEHOLDER.search(segment):
+            return self._walk(node.parameter, segments, position + 1)
+        return None
+
+    def match(self, service_id, method, endpoint):
+        """
+        Returns (canonical_url, operation_key), or None if the endpoint is not an
+        operation of the service or still contains placeholders.
+        """
+        root = self._roots.get((service_id, str(method).upper()))
+        if root is None or not isinstance(endpoint, str):
+            return None
+        parts = urlsplit(endpoint.strip())
+        segments = _segments(parts.path)
+        operation = self._walk(root, segments, 0)
+        if operation is None or PLACEHOLDER.search(unquote_plus(parts.query)):
+            return None
+        key, scheme, netloc, template = operation
+        path = "/" + "/".join(
+            concrete if TEMPLATE_PARAMETER.match(literal) else literal
+            for literal, concrete in zip(template, segments)
+        )
+        return urlunsplit((scheme, netloc, path, parts.query, "")), key
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def compiled_index(services):
+    """
+    The EndpointIndex of a set of candidate services, reused across requests
+    that retrieve the same services.
+    """
+    key = frozenset(
+        (service.get("_id"), operation, url)
+        for service in services
+        for operation, url in (service.get("endpoints") or {}).items()
+        if isinstance(url, str)
+    )
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = EndpointIndex(services)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
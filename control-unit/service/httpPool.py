@@ -0,0 +1,105 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "32"))
+
+AIOHTTP_LIMIT = int(os.environ.get("AIOHTTP_LIMIT", "100"))
+AIOHTTP_LIMIT_PER_HOST = int(os.environ.get("AIOHTTP_LIMIT_PER_HOST", "20"))
+AIOHTTP_DNS_TTL = int(os.environ.get("AIOHTTP_DNS_TTL", "300"))
+AIOHTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("AIOHTTP_KEEPALIVE_TIMEOUT", "30"))
+
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", "32"))
+# Planner generations wait for admission inside their thread, so the planner
+# executor must hold every generation the admission queues of all backends accept.
+_BACKENDS = len([u for u in os.environ.get("OLLAMA_API_URLS", os.environ.get("OLLAMA_API_URL", "")).split(",") if u.strip()]) or 1
+PLANNER_WORKERS = int(os.environ.get("PLANNER_WORKERS", str(
+    _BACKENDS * (int(os.environ.get("LLM_MAX_IN_FLIGHT", "2")) + int(os.environ.get("LLM_MAX_QUEUE", "64")))
+)))
+
+_session = None
+_runner = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Process-wide requests.Session with a pooled adapter, shared by all request threads.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+class EventLoopRunner:
+    """
+    Long-lived event loop running in a daemon thread. Coroutines submitted from
+    request threads share one aiohttp connector, so DNS, TCP and keep-alive
+    state survive across requests.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.blocking = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="control-unit-blocking")
+        self.planning = ThreadPoolExecutor(max_workers=PLANNER_WORKERS, thread_name_prefix="control-unit-planner")
+        self._client = None
+        self._thread = threading.Thread(target=self._run, name="control-unit-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def run_blocking(self, func, *args):
+        """
+        Runs a blocking call (e.g. the planner request) off the event loop, in a
+        copy of the caller's context so that context variables like the current
+        trace span carry over.
+        """
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(self.blocking, context.run, func, *args)
+
+    async def run_planning(self, func, *args):
+        """
+        Like run_blocking, on the planner executor: planner calls can wait a long
+        time for LLM admission and must not starve other blocking calls.
+        """
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(self.planning, context.run, func, *args)
+
+    async def client(self):
+        if self._client is None or self._client.closed:
+            connector = aiohttp.TCPConnector(
+                limit=AIOHTTP_LIMIT,
+                limit_per_host=AIOHTTP_LIMIT_PER_HOST,
+                ttl_dns_cache=AIOHTTP_DNS_TTL,
+                keepalive_timeout=AIOHTTP_KEEPALIVE_TIMEOUT
+            )
+            self._client = aiohttp.ClientSession(connector=connector)
+        return self._client
+
+
+def get_runner():
+    global _runner
+    if _runner is None:
+        with _lock:
+            if _runner is None:
+                _runner = EventLoopRunner()
+    return _runner
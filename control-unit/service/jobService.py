@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from service.controlService import Controller
+from common import tracing
+
+TERMINAL_STATES = {"succeeded", "failed", "cancelled"}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self, query, priority=0, budget=None):
+        self.id = uuid.uuid4().hex
+        self.query = query
+        self.priority = priority
+        self.budget = budget
+        self.status = "queued"
+        self.created = time.time()
+        self.finished = None
+        self.plan = None
+        self.results = []
+        self.error = None
+        self.version = 0
+        self.controller = None
+        # Jobs run after the submitting request has returned, in its trace.
+        self.trace_parent = tracing.current_span()
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "query": self.query,
+            "status": self.status,
+            "version": self.version,
+            "created": self.created,
+            "finished": self.finished,
+            "execution_plan": self.plan,
+            "execution_results": self.results,
+            "error": self.error
+        }
+
+
+class JobManager:
+    """
+    Runs /invoke queries as background jobs on a bounded worker pool, so request
+    threads never wait on the LLM. Finished jobs are kept for JOB_TTL seconds.
+    """
+
+    def __init__(self):
+        self.workers = int(os.environ.get("JOB_WORKERS", "4"))
+        self.max_pending = int(os.environ.get("JOB_MAX_PENDING", "100"))
+        self.ttl = float(os.environ.get("JOB_TTL", "3600"))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="control-unit-job")
+        self._jobs = {}
+        self._changed = threading.Condition()
+
+    def _update(self, job, **fields):
+        with self._changed:
+            # A finished or cancelled job never changes again.
+            if job.status in TERMINAL_STATES:
+                return
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.version += 1
+            self._changed.notify_all()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            self._jobs.pop(job_id, None)
+
+    def submit(self, query, priority=0, budget=None):
+        with self._changed:
+            self._expire()
+            pending = sum(1 for j in self._jobs.values() if j.status not in TERMINAL_STATES)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({pending})")
+            job = Job(query, priority, budget)
+            self._jobs[job.id] = job
+        self.executor.submit(self._run, job)
+        return job
+
+    def _on_event(self, job, event, payload):
+        if event == "services":
+            self._update(job, status="planning")
+        elif event == "plan":
+            self._update(job, status="running", plan=payload)
+        elif event == "task_result":
+            self._update(job, results=job.results + [payload])
+
+    def _run(self, job):
+        job.controller = Controller(
+            on_event=lambda event, payload: self._on_event(job, event, payload),
+            priority=job.priority,
+            budget=job.budget,
+            trace_parent=job.trace_parent
+        )
+        if job.status == "cancelled":
+            return
+        self._update(job, status="planning")
+        try:
+            response = job.controller.control(job.query)
+        except CancelledError:
+            self._update(job, status="cancelled", finished=time.time())
+            return
+        except Exception as e:
+            self._update(job, status="failed", error=str(e), finished=time.time())
+            return
+
+        status = "failed" if response.get("error") else "succeeded"
+        self._update(
+            job,
+            status=status,
+            plan=response.get("execution_plan"),
+            results=response.get("execution_results", []),
+            error=response.get("error"),
+            finished=time.time()
+        )
+
+    def get(self, job_id, since=None, wait=0):
+        """
+        Returns the job snapshot. With wait > 0, long-polls until the job version
+        moves past `since` or the job reaches a terminal state.
+        """
+        deadline = time.monotonic() + wait
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if since is not None:
+                while job.version <= since and job.status not in TERMINAL_STATES:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+            return job.snapshot()
+
+    def cancel(self, job_id):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status in TERMINAL_STATES:
+                return job.snapshot()
+        if job.controller is not None:
+            job.controller.cancel()
+        self._update(job, status="cancelled", finished=time.time())
+        return job.snapshot()
@@ -0,0 +1,156 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+
+from service.httpPool import get_session
+from service.llmGateway import get_gateway
+
+logger = logging.getLogger("control-unit")
+
+
+class BackendUnavailable(RuntimeError):
+    pass
+
+
+class Backend:
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.models = set()
+        # num_ctx each loaded model runs with, when known.
+        self.contexts = {}
+        self.checked = None
+        self.failures = 0
+
+    def snapshot(self):
+        gateway = get_gateway(self.url)
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "loaded_models": sorted(self.models),
+            "contexts": dict(self.contexts),
+            "outstanding": gateway.outstanding(),
+            "failures": self.failures
+        }
+
+
+class BackendPool:
+    """
+    The Ollama instances the planner can use (OLLAMA_API_URLS, comma separated,
+    falling back to OLLAMA_API_URL). A background thread polls /api/ps to track
+    health and which models each backend has loaded; choose() prefers healthy
+    backends that already hold the model with the requested context size, then
+    the fewest outstanding requests.
+    """
+
+    def __init__(self, urls=None):
+        if urls is None:
+            configured = os.environ.get("OLLAMA_API_URLS") or os.environ.get("OLLAMA_API_URL", "http://localhost:11434")
+            urls = [u.strip() for u in configured.split(",") if u.strip()]
+        self.backends = [Backend(url) for url in urls]
+        self.interval = float(os.environ.get("LLM_HEALTH_INTERVAL", "10"))
+        self.timeout = float(os.environ.get("LLM_HEALTH_TIMEOUT", "2"))
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and len(self.backends) > 1:
+            self._thread = threading.Thread(target=self._watch, name="llm-health", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            for backend in self.backends:
+                self.check(backend)
+            self._stopped.wait(self.interval)
+
+    def check(self, backend):
+        try:
+            response = get_session().get(f"{backend.url}/api/ps", timeout=self.timeout)
+            response.raise_for_status()
+            running = response.json().get("models", [])
+            models = {m.get("name") or m.get("model") for m in running}
+            contexts = {m.get("name") or m.get("model"): m["context_length"] for m in running if m.get("context_length")}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            with self._lock:
+                if backend.healthy:
+                    logger.warning(f"[LLM BACKEND] {backend.url} is unhealthy: {e}")
+                backend.healthy = False
+                backend.checked = time.monotonic()
+            return
+        with self._lock:
+            if not backend.healthy:
+                logger.info(f"[LLM BACKEND] {backend.url} is healthy again")
+            backend.healthy = True
+            backend.models = models
+            backend.contexts = {model: contexts.get(model, backend.contexts.get(model)) for model in models}
+            backend.checked = time.monotonic()
+
+    def choose(self, model, exclude=(), num_ctx=None):
+        """
+        Returns the backend to try next, or None when every backend has been tried.
+        Unhealthy backends are only used when no healthy one is left. A backend
+        running the model with another num_ctx would reload it, so it ranks
+        after those running it with `num_ctx`.
+        """
+        with self._lock:
+            candidates = [b for b in self.backends if b.url not in exclude]
+            if not candidates:
+                return None
+            healthy = [b for b in candidates if b.healthy] or candidates
+            random.shuffle(healthy)
+            return min(healthy, key=lambda b: (
+                model not in b.models,
+                num_ctx is not None and b.contexts.get(model, num_ctx) != num_ctx,
+                get_gateway(b.url).outstanding()
+            ))
+
+    def mark_failed(self, backend):
+        with self._lock:
+            backend.failures += 1
+            if len(self.backends) > 1:
+                backend.healthy = False
+
+    def mark_loaded(self, backend, model, num_ctx=None):
+        with self._lock:
+            backend.healthy = True
+            backend.models.add(model)
+            if num_ctx is not None:
+                backend.contexts[model] = num_ctx
+
+    def stats(self):
+        with self._lock:
+            return [b.snapshot() for b in self.backends]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_backend_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BackendPool().start()
+        return _pool
+
+
+def set_backend_pool(pool):
+    """
+    Replaces the shared pool, e.g. with one pointing at local stand-in servers.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.stop()
+        _pool = pool
@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Admission:
+    """
+    A slot granted by LLMGateway.admit(). Only generations marked as succeeded
+    update the expected generation time, so instant failures and cancelled
+    streams do not drag it towards zero.
+    """
+
+    def __init__(self):
+        self.succeeded = False
+
+    def succeed(self):
+        self.succeeded = True
+
+
+class LLMGateway:
+    """
+    Admission control in front of one LLM backend: at most LLM_MAX_IN_FLIGHT
+    generations run at once, the rest wait in a priority queue ordered by
+    (priority, deadline). Requests whose deadline can no longer be met, given
+    the observed generation time, are rejected early with a Retry-After hint.
+    """
+
+    def __init__(self, max_in_flight=None, max_queue=None):
+        self.max_in_flight = max_in_flight or int(os.environ.get("LLM_MAX_IN_FLIGHT", "2"))
+        self.max_queue = max_queue or int(os.environ.get("LLM_MAX_QUEUE", "64"))
+        self.service_time = float(os.environ.get("LLM_EXPECTED_SECONDS", "60"))
+        self.in_flight = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _expected_wait(self, ahead):
+        if self.in_flight < self.max_in_flight and ahead == 0:
+            return 0.0
+        return (ahead // self.max_in_flight + 1) * self.service_time
+
+    def _reject_if_late(self, deadline, ahead):
+        if deadline is None:
+            return
+        expected = self._expected_wait(ahead)
+        if time.monotonic() + expected + self.service_time > deadline:
+            raise AdmissionRejected(
+                f"LLM backend saturated: expected wait {expected:.0f}s exceeds the request deadline",
+                retry_after=expected or self.service_time
+            )
+
+    def _remove(self, entry):
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        self._cond.notify_all()
+
+    def acquire(self, priority=0, deadline=None, cancelled=None):
+        with self._cond:
+            if self.in_flight < self.max_in_flight and not self._queue:
+                self.in_flight += 1
+                return
+            if len(self._queue) >= self.max_queue:
+                raise AdmissionRejected("LLM queue is full", retry_after=self.service_time)
+
+            entry = (priority, deadline if deadline is not None else math.inf, next(self._seq))
+            self._reject_if_late(deadline, sum(1 for queued in self._queue if queued < entry))
+            heapq.heappush(self._queue, entry)
+
+            while True:
+                if self._queue[0] == entry and self.in_flight < self.max_in_flight:
+                    heapq.heappop(self._queue)
+                    self.in_flight += 1
+                    self._cond.notify_all()
+                    return
+                if cancelled is not None and cancelled.is_set():
+                    self._remove(entry)
+                    raise AdmissionRejected("Request cancelled while queued", retry_after=0)
+                if deadline is not None and time.monotonic() + self.service_time > deadline:
+                    self._remove(entry)
+                    raise AdmissionRejected("Request deadline expired while queued", retry_after=self.service_time)
+                self._cond.wait(timeout=1.0)
+
+    def release(self, elapsed=None):
+        with self._cond:
+            self.in_flight -= 1
+            if elapsed is not None:
+                # Exponentially weighted moving average of the generation time.
+                self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, priority=0, deadline=None, cancelled=None):
+        self.acquire(priority, deadline, cancelled)
+        admission = Admission()
+        started = time.monotonic()
+        try:
+            yield admission
+        finally:
+            self.release(time.monotonic() - started if admission.succeeded else None)
+
+    def outstanding(self):
+        return self.in_flight + len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "max_in_flight": self.max_in_flight,
+                "expected_seconds": round(self.service_time, 2)
+            }
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(backend_url):
+    with _gateways_lock:
+        if backend_url not in _gateways:
+            _gateways[backend_url] = LLMGateway()
+        return _gateways[backend_url]
+
+
+def gateway_stats():
+    with _gateways_lock:
+        return {url: gateway.stats() for url, gateway in _gateways.items()}
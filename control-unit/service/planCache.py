@@ -0,0 +1,214 @@
+import copy
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote, unquote, urlsplit, urlunsplit
+
+import numpy as np
+
+PARAMETER_PATTERN = re.compile(r"""([A-Za-z_][\w\-]*)\s*[:=]\s*('[^']*'|"[^"]*"|[^\s,;]+)""")
+LITERAL_PATTERN = re.compile(r"""'[^']*'|"[^"]*"|\b\d+(?:\.\d+)?\b""")
+PLACEHOLDER_PATTERN = re.compile(r"(?<!\{)\{[^{}/]+\}(?!\})")
+
+
+def _strip_value(value):
+    value = value.strip().rstrip(".")
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        value = value[1:-1]
+    return value
+
+
+def extract_parameters(query):
+    """
+    Explicit key: value pairs of a query, e.g. "id: 3, location: 'City Square'".
+    """
+    parameters = {}
+    for key, value in PARAMETER_PATTERN.findall(query):
+        parameters[key.lower()] = _strip_value(value)
+    return parameters
+
+
+def extract_free_literals(query):
+    """
+    Numbers and quoted strings of a query that are not part of a key: value pair.
+    """
+    masked = PARAMETER_PATTERN.sub(" ", query)
+    return sorted(_strip_value(m) for m in LITERAL_PATTERN.findall(masked))
+
+
+class PlanCache:
+    """
+    Two-tier cache of execution plans:
+    - exact: keyed by the SHA-256 of the prompt sent to the planner;
+    - semantic (opt-in): reuses the plan of a query whose embedding is above the
+      similarity threshold and whose candidate service set is the same, after
+      re-resolving the parameter values used in endpoints and inputs.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, semantic=None, threshold=None):
+        self.enabled = os.environ.get("PLAN_CACHE_ENABLED", "true").lower() == "true"
+        self.max_entries = max_entries or int(os.environ.get("PLAN_CACHE_SIZE", "256"))
+        self.ttl = ttl or float(os.environ.get("PLAN_CACHE_TTL", "600"))
+        if semantic is None:
+            semantic = os.environ.get("PLAN_CACHE_SEMANTIC", "false").lower() == "true"
+        self.semantic = semantic
+        self.threshold = threshold or float(os.environ.get("PLAN_CACHE_SIMILARITY", "0.95"))
+
+        self._exact = OrderedDict()
+        self._semantic = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @staticmethod
+    def prompt_key(prompt):
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def service_key(services):
+        operations = set()
+        for service in services:
+            for operation in (service.get("endpoints") or {}):
+                operations.add(f"{service.get('_id')}|{operation}")
+        return frozenset(operations)
+
+    def _evict(self, entries):
+        now = time.monotonic()
+        for key in [k for k, entry in entries.items() if now - entry["created"] > self.ttl]:
+            entries.pop(key, None)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def get(self, prompt, query, query_embedding, service_key):
+        """
+        Returns (plan, tier) on a hit, (None, None) on a miss.
+        """
+        if not self.enabled:
+            return None, None
+
+        prompt_key = self.prompt_key(prompt)
+        with self._lock:
+            self._evict(self._exact)
+            entry = self._exact.get(prompt_key)
+            if entry is not None:
+                self._exact.move_to_end(prompt_key)
+                self.stats["exact_hits"] += 1
+                return copy.deepcopy(entry["plan"]), "exact"
+
+            candidates = []
+            if self.semantic and query_embedding is not None:
+                self._evict(self._semantic)
+                candidates = [e for e in self._semantic.values() if e["service_key"] == service_key]
+
+        if candidates:
+            vector = np.asarray(query_embedding, dtype=np.float32)
+            matrix = np.stack([e["embedding"] for e in candidates])
+            norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(vector) or 1.0)
+            scores = matrix @ vector / np.where(norms == 0, 1.0, norms)
+            for index in np.argsort(-scores):
+                if scores[index] < self.threshold:
+                    break
+                plan = self.resolve(candidates[index], query)
+                if plan is not None:
+                    with self._lock:
+                        self.stats["semantic_hits"] += 1
+                    return plan, "semantic"
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, None
+
+    def put(self, prompt, query, query_embedding, service_key, plan):
+        if not self.enabled or not plan or not plan.get("tasks"):
+            return
+
+        prompt_key = self.prompt_key(prompt)
+        entry = {
+            "created": time.monotonic(),
+            "query": query,
+            "parameters": extract_parameters(query),
+            "literals": extract_free_literals(query),
+            "service_key": service_key,
+            "plan": copy.deepcopy(plan),
+        }
+        with self._lock:
+            self._exact[prompt_key] = entry
+            self._evict(self._exact)
+            if self.semantic and query_embedding is not None:
+                entry["embedding"] = np.asarray(query_embedding, dtype=np.float32)
+                self._semantic[prompt_key] = entry
+                self._evict(self._semantic)
+
+    def resolve(self, entry, query):
+        """
+        Adapts a cached plan to a new query by substituting its parameter values.
+        Returns None when the new query cannot be mapped onto the cached plan.
+        """
+        parameters = extract_parameters(query)
+        if set(parameters) != set(entry["parameters"]):
+            return None
+        if extract_free_literals(query) != entry["literals"]:
+            return None
+
+        substitutions = {}
+        for key, old_value in entry["parameters"].items():
+            new_value = parameters[key]
+            if old_value == new_value:
+                continue
+            if substitutions.get(old_value, new_value) != new_value:
+                return None
+            substitutions[old_value] = new_value
+
+        plan = copy.deepcopy(entry["plan"])
+        for task in plan.get("tasks", []):
+            endpoint = task.get("endpoint")
+            if isinstance(endpoint, str):
+                endpoint = self._resolve_endpoint(endpoint, substitutions)
+                if PLACEHOLDER_PATTERN.search(unquote(endpoint)):
+                    return None
+                task["endpoint"] = endpoint
+            task["input"] = self._resolve_value(task.get("input"), substitutions)
+        return plan
+
+    @staticmethod
+    def _resolve_endpoint(endpoint, substitutions):
+        if not substitutions:
+            return endpoint
+        parts = urlsplit(endpoint)
+        segments = [
+            quote(substitutions[unquote(segment)]) if unquote(segment) in substitutions else segment
+            for segment in parts.path.split("/")
+        ]
+        query_items = []
+        for item in parts.query.split("&") if parts.query else []:
+            name, sep, value = item.partition("=")
+            if unquote(value) in substitutions:
+                value = quote(substitutions[unquote(value)])
+            query_items.append(f"{name}{sep}{value}")
+        return urlunsplit((parts.scheme, parts.netloc, "/".join(segments), "&".join(query_items), parts.fragment))
+
+    def _resolve_value(self, value, substitutions):
+        if not substitutions:
+            return value
+        if isinstance(value, dict):
+            return {k: self._resolve_value(v, substitutions) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._resolve_value(v, substitutions) for v in value]
+        if isinstance(value, bool) or value is None:
+            return value
+        if str(value) in substitutions:
+            new_value = substitutions[str(value)]
+            if isinstance(value, int):
+                try:
+                    return int(new_value)
+                except ValueError:
+                    return new_value
+            if isinstance(value, float):
+                try:
+                    return float(new_value)
+                except ValueError:
+                    return new_value
+            return new_value
+        return value
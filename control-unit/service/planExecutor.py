@@ -0,0 +1,199 @@
+import asyncio
+import os
+import re
+from urllib.parse import quote, urlsplit
+
+REFERENCE_PATTERN = re.compile(r"\{\{\s*([\w\-]+)((?:\.[\w\-]+)*)\s*\}\}")
+
+EXECUTOR_MAX_CONCURRENCY = int(os.environ.get("EXECUTOR_MAX_CONCURRENCY", "32"))
+EXECUTOR_MAX_PER_HOST = int(os.environ.get("EXECUTOR_MAX_PER_HOST", "8"))
+
+
+class PlanReferenceError(Exception):
+    pass
+
+
+def find_references(value):
+    if isinstance(value, str):
+        return {match.group(1) for match in REFERENCE_PATTERN.finditer(value)}
+    if isinstance(value, dict):
+        return set().union(*(find_references(v) for v in value.values())) if value else set()
+    if isinstance(value, list):
+        return set().union(*(find_references(v) for v in value)) if value else set()
+    return set()
+
+
+class PlanExecutor:
+    """
+    Runs the tasks of an execution plan as a DAG. Tasks may declare an "id",
+    "depends_on" (ids or task names) and reference upstream outputs as
+    {{task_id.result.field}} in their endpoint or input; references imply a
+    dependency. Independent tasks run in parallel under a global and a
+    per-host concurrency limit shared by all plans.
+    """
+
+    def __init__(self, max_concurrency=EXECUTOR_MAX_CONCURRENCY, max_per_host=EXECUTOR_MAX_PER_HOST):
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self._global = None
+        self._hosts = {}
+
+    @staticmethod
+    def endpoint_host(task):
+        endpoint = task.get("endpoint")
+        return urlsplit(endpoint).netloc if isinstance(endpoint, str) else ""
+
+    def _host_semaphore(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.max_per_host)
+        return self._hosts[host]
+
+    @staticmethod
+    def _task_ids(tasks):
+        ids = []
+        for index, task in enumerate(tasks):
+            task_id = str(task.get("id") or f"task_{index + 1}")
+            if task_id in ids:
+                task_id = f"{task_id}_{index + 1}"
+            ids.append(task_id)
+        return ids
+
+    def build_graph(self, tasks):
+        """
+        Returns (ids, dependencies, errors): dependencies maps each task index to
+        the indices it waits for, errors maps invalid task indices to a reason.
+        """
+        ids = self._task_ids(tasks)
+        lookup = {task_id: index for index, task_id in enumerate(ids)}
+        for index, task in enumerate(tasks):
+            name = task.get("task_name")
+            if name and name not in lookup:
+                lookup[name] = index
+
+        dependencies = {}
+        errors = {}
+        for index, task in enumerate(tasks):
+            declared = task.get("depends_on") or []
+            if isinstance(declared, str):
+                declared = [declared]
+            wanted = set(map(str, declared)) | find_references(task.get("endpoint")) | find_references(task.get("input"))
+            unknown = [dep for dep in wanted if dep not in lookup]
+            if unknown:
+                errors[index] = f"Unknown dependency: {', '.join(sorted(unknown))}"
+            dependencies[index] = {lookup[dep] for dep in wanted if dep in lookup and lookup[dep] != index}
+
+        # Kahn's algorithm: whatever cannot be ordered is part of a cycle.
+        indegree = {index: len(deps) for index, deps in dependencies.items()}
+        dependents = {index: [] for index in dependencies}
+        for index, deps in dependencies.items():
+            for dep in deps:
+                dependents[dep].append(index)
+        ready = [index for index, degree in indegree.items() if degree == 0]
+        ordered = set()
+        while ready:
+            index = ready.pop()
+            ordered.add(index)
+            for dependent in dependents[index]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+        for index in dependencies:
+            if index not in ordered:
+                errors.setdefault(index, "Dependency cycle")
+
+        return ids, dependencies, errors
+
+    @staticmethod
+    def _lookup(results, task_id, path):
+        if task_id not in results:
+            raise PlanReferenceError(f"Unresolved reference: {task_id}{path}")
+        value = results[task_id]
+        for key in filter(None, path.split(".")):
+            if isinstance(value, list) and key.isdigit() and int(key) < len(value):
+                value = value[int(key)]
+            elif isinstance(value, dict) and key in value:
+                value = value[key]
+            else:
+                raise PlanReferenceError(f"Unresolved reference: {task_id}{path}")
+        return value
+
+    def resolve(self, value, results, url=False):
+        if isinstance(value, str):
+            whole = REFERENCE_PATTERN.fullmatch(value.strip())
+            if whole and not url:
+                return self._lookup(results, whole.group(1), whole.group(2))
+
+            def substitute(match):
+                resolved = self._lookup(results, match.group(1), match.group(2))
+                return quote(str(resolved), safe="") if url else str(resolved)
+            return REFERENCE_PATTERN.sub(substitute, value)
+        if isinstance(value, dict):
+            return {k: self.resolve(v, results) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(v, results) for v in value]
+        return value
+
+    @staticmethod
+    def _failure(task, task_id, status, reason, status_code=None):
+        return {
+            "operation": str(task.get("operation", "")).upper(),
+            "status": status,
+            "status_code": status_code,
+            "task_name": task.get("task_name"),
+            "task_id": task_id,
+            "result": reason
+        }
+
+    async def run(self, tasks, call, on_result=None, host_of=None):
+        """
+        Executes the tasks with call(task) and returns their results in plan order.
+        on_result, if given, is called with each result as soon as it completes.
+        host_of(task) names the host whose concurrency limit a task counts against,
+        by default the host of its endpoint.
+        """
+        host_of = host_of or self.endpoint_host
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_concurrency)
+
+        ids, dependencies, errors = self.build_graph(tasks)
+        futures = [asyncio.get_running_loop().create_future() for _ in tasks]
+        outputs = {}
+
+        async def execute(index):
+            task = tasks[index]
+            task_id = ids[index]
+            try:
+                if index in errors:
+                    return self._failure(task, task_id, "INVALID", errors[index])
+
+                upstream = [await futures[dep] for dep in dependencies[index]]
+                failed = [r["task_id"] for r in upstream if r.get("status") != "SUCCESS"]
+                if failed:
+                    return self._failure(task, task_id, "SKIPPED", f"Upstream task failed: {', '.join(failed)}")
+
+                try:
+                    resolved = dict(task)
+                    resolved["endpoint"] = self.resolve(task.get("endpoint"), outputs, url=True)
+                    resolved["input"] = self.resolve(task.get("input"), outputs)
+                except PlanReferenceError as e:
+                    return self._failure(task, task_id, "INVALID", str(e))
+
+                async with self._global, self._host_semaphore(host_of(resolved)):
+                    result = await call(resolved)
+                result["task_id"] = task_id
+                return result
+            except Exception as e:
+                return self._failure(task, task_id, "EXCEPTION", str(e), 500)
+
+        async def settle(index):
+            result = await execute(index)
+            outputs[ids[index]] = result
+            name = tasks[index].get("task_name")
+            if name and name not in ids:
+                outputs.setdefault(name, result)
+            futures[index].set_result(result)
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        return await asyncio.gather(*(settle(index) for index in range(len(tasks))))
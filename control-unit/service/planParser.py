@@ -0,0 +1,264 @@
+import json
+import re
+
+THINK_OPEN_PATTERN = re.compile(r'<think>', flags=re.IGNORECASE)
+THINK_CLOSE_PATTERN = re.compile(r'</think>', flags=re.IGNORECASE)
+FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", flags=re.DOTALL)
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+OPERATIONS = {"GET", "POST", "PUT", "DELETE"}
+TASK_LIST_KEYS = ("tasks", "plan", "execution_plan", "steps")
+TASK_KEY_ALIASES = {
+    "method": "operation",
+    "http_method": "operation",
+    "url": "endpoint",
+    "path": "endpoint",
+    "service": "service_id",
+    "serviceId": "service_id",
+    "name": "task_name",
+    "dependencies": "depends_on",
+}
+
+
+class PlanParseError(Exception):
+    pass
+
+
+def _clean(text):
+    """
+    Removes trailing commas and // comments, and turns Python literals and
+    single-quoted strings into JSON, outside of double-quoted strings.
+    """
+    out = []
+    i = 0
+    in_string = False
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            out.append(char)
+            if char == "\\" and i + 1 < len(text):
+                out.append(text[i + 1])
+                i += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char == "'":
+            i = _requote(text, i + 1, out)
+            continue
+        elif char == "/" and text.startswith("//", i):
+            while i < len(text) and text[i] != "\n":
+                i += 1
+            continue
+        elif char == ",":
+            rest = text[i + 1:].lstrip()
+            if not rest or rest[0] not in "}]":
+                out.append(char)
+        elif char.isalpha():
+            # \w also matches non-ASCII letters, so the match always has at least one character.
+            word = re.match(r"\w+", text[i:]).group(0)
+            out.append(PYTHON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(char)
+        i += 1
+    return "".join(out)
+
+
+def _requote(text, start, out):
+    """
+    Appends the single-quoted string whose content begins at `start` as a JSON
+    string. Returns the position after its closing quote.
+    """
+    chars = []
+    i = start
+    while i < len(text) and text[i] != "'":
+        char = text[i]
+        if char == "\\" and i + 1 < len(text):
+            chars.append(text[i + 1] if text[i + 1] == "'" else text[i:i + 2])
+            i += 2
+            continue
+        chars.append('\\"' if char == '"' else char)
+        i += 1
+    out.append('"' + "".join(chars) + '"')
+    return i + 1
+
+
+def lenient_loads(text):
+    """
+    json.loads that tolerates trailing commas, comments and Python literals.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(_clean(text))
+
+
+def _complete(text, start):
+    """
+    Scans the JSON value starting at `start`. Returns (end, None) if it is
+    balanced, or (None, repaired) with a best-effort completion of a truncated
+    value: cut after the last complete element and close the open brackets.
+    """
+    stack = []
+    quote = None
+    escape = False
+    last_complete = None
+    for position in range(start, len(text)):
+        char = text[position]
+        if quote is not None:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                quote = None
+            continue
+        if char in "\"'":
+            quote = char
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack:
+                return position, None
+            stack.pop()
+            if not stack:
+                return position + 1, None
+            last_complete = (position + 1, "".join(reversed(stack)))
+    if last_complete is None:
+        return None, None
+    cut, closers = last_complete
+    return None, text[start:cut] + closers
+
+
+def extract_json(text):
+    """
+    Returns (value, repairs) for the first JSON object or array in the text.
+    """
+    repairs = []
+    fenced = FENCE_PATTERN.search(text)
+    if fenced and re.search(r"[\[{]", fenced.group(1)):
+        text = fenced.group(1)
+        repairs.append("unwrapped code fence")
+
+    for match in re.finditer(r"[\[{]", text):
+        start = match.start()
+        end, truncated = _complete(text, start)
+        candidate = text[start:end] if end is not None else truncated
+        if candidate is None:
+            continue
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            try:
+                value = json.loads(_clean(candidate))
+            except (ValueError, RecursionError):
+                continue
+            repairs.append("removed invalid JSON syntax")
+        if truncated is not None:
+            repairs.append("completed truncated output")
+        if isinstance(value, (dict, list)):
+            return value, repairs
+    raise PlanParseError("No JSON plan found in the response")
+
+
+def _normalize_task(task, repairs):
+    for alias, key in TASK_KEY_ALIASES.items():
+        if alias in task and key not in task:
+            task[key] = task.pop(alias)
+            repairs.append(f"renamed {alias} to {key}")
+    operation = task.get("operation")
+    if isinstance(operation, str) and operation != operation.strip().upper():
+        task["operation"] = operation.strip().upper()
+        repairs.append("normalized operation case")
+    if isinstance(task.get("depends_on"), str):
+        task["depends_on"] = [task["depends_on"]]
+    if task.get("input") is None:
+        task["input"] = ""
+    return task
+
+
+def normalize_plan(value):
+    """
+    Brings a decoded response into the {"tasks": [...]} shape. Returns (plan, repairs).
+    """
+    repairs = []
+    if isinstance(value, list):
+        value = {"tasks": value}
+        repairs.append("added tasks wrapper")
+    elif isinstance(value, dict) and "tasks" not in value:
+        for key in TASK_LIST_KEYS[1:]:
+            if isinstance(value.get(key), list):
+                value = {**value, "tasks": value.pop(key)}
+                repairs.append(f"renamed {key} to tasks")
+                break
+        else:
+            if "endpoint" in value or "url" in value:
+                value = {"tasks": [value]}
+                repairs.append("added tasks wrapper")
+
+    tasks = value.get("tasks") if isinstance(value, dict) else None
+    if isinstance(tasks, dict):
+        value["tasks"] = tasks = [tasks]
+        repairs.append("wrapped single task")
+    if isinstance(tasks, list):
+        kept = [_normalize_task(task, repairs) for task in tasks if isinstance(task, dict)]
+        if len(kept) != len(tasks):
+            repairs.append("dropped non-object tasks")
+        value["tasks"] = kept
+    return value, repairs
+
+
+def schema_problems(plan):
+    if not isinstance(plan, dict) or not isinstance(plan.get("tasks"), list):
+        return ["plan has no task list"]
+    problems = []
+    for position, task in enumerate(plan["tasks"]):
+        name = task.get("id") or task.get("task_name") or position
+        for key in ("service_id", "endpoint"):
+            if not isinstance(task.get(key), str) or not task[key]:
+                problems.append(f"task {name}: missing {key}")
+        if task.get("operation") not in OPERATIONS:
+            problems.append(f"task {name}: invalid operation {task.get('operation')}")
+    return problems
+
+
+def strip_think(text):
+    """
+    The part of a response after its last </think> tag (all of it if there is none).
+    """
+    close = None
+    for close in THINK_CLOSE_PATTERN.finditer(text):
+        pass
+    return text[close.end():] if close is not None else text
+
+
+def parse_plan(text, thinking=True):
+    """
+    Extracts the execution plan from a planner response. Returns (plan, repairs)
+    or raises PlanParseError when no plan matching the schema can be recovered.
+    """
+    answer = strip_think(text)
+    if answer is text and thinking and THINK_OPEN_PATTERN.search(text):
+        raise PlanParseError("Response ended inside the <think> block")
+    text = answer
+
+    try:
+        value, repairs = extract_json(text)
+        plan, normalized = normalize_plan(value)
+    except PlanParseError:
+        raise
+    except (ValueError, TypeError, AttributeError, IndexError, RecursionError) as e:
+        raise PlanParseError(f"Cannot repair the response: {e}")
+    repairs.extend(normalized)
+    problems = schema_problems(plan)
+    if problems:
+        raise PlanParseError("; ".join(problems))
+    return plan, repairs
+
+
+def is_plan(value):
+    return (isinstance(value, dict) and "tasks" in value) or (
+        isinstance(value, list) and bool(value) and all(isinstance(v, dict) for v in value)
+    )
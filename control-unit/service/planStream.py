@@ -0,0 +1,89 @@
+import re
+
+from service.planParser import is_plan, lenient_loads
+
+THINK_CLOSE_PATTERN = re.compile(r'</think>', flags=re.IGNORECASE)
+THINK_CLOSE_LENGTH = len("</think>")
+
+
+class PlanStreamParser:
+    """
+    Incremental parser for a streamed planner response.
+    Detects the end of the <think> block and completes as soon as the first
+    balanced JSON object or array after it decodes (leniently) to a plan.
+    Responses of models that do not think (thinking=False) are scanned from the start.
+    """
+
+    def __init__(self, thinking=True):
+        self.text = ""
+        self.think_end = None if thinking else 0
+        self.plan = None
+        self.plan_end = None
+        self._start = None
+        self._cursor = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self):
+        return self.plan is not None
+
+    def feed(self, chunk):
+        """
+        Appends a chunk of generated text. Returns True once the plan is complete.
+        """
+        if self.done or not chunk:
+            return self.done
+        self.text += chunk
+
+        if self.think_end is None:
+            search_from = max(0, len(self.text) - len(chunk) - THINK_CLOSE_LENGTH)
+            match = THINK_CLOSE_PATTERN.search(self.text, search_from)
+            if not match:
+                return False
+            self.think_end = match.end()
+            self._cursor = self.think_end
+
+        self._scan()
+        return self.done
+
+    def _scan(self):
+        text = self.text
+        while self._cursor < len(text):
+            char = text[self._cursor]
+            self._cursor += 1
+
+            if self._start is None:
+                if char in "{[":
+                    self._start = self._cursor - 1
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        value = lenient_loads(text[self._start:self._cursor])
+                    except (ValueError, RecursionError):
+                        value = None
+                    if is_plan(value):
+                        self.plan = value
+                        self.plan_end = self._cursor
+                        return
+                    if value is None:
+                        self._cursor = self._start + 1
+                    self._start = None
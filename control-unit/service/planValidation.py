@@ -0,0 +1,46 @@
+import re
+
+from service.planExecutor import PlanExecutor
+
+OPERATIONS = {"GET", "POST", "PUT", "DELETE"}
+REFERENCE = re.compile(r"\{\{[^{}]+\}\}")
+
+_graph = PlanExecutor()
+
+
+def validate_plan(plan, index):
+    """
+    Structural and catalog checks of a plan against the EndpointIndex of the
+    candidate services. Returns the list of problems found; an empty list means
+    the plan is valid.
+    """
+    if not isinstance(plan, dict) or not isinstance(plan.get("tasks"), list):
+        return ["plan has no task list"]
+    tasks = plan["tasks"]
+    if not tasks:
+        return ["plan has no tasks"]
+
+    problems = []
+    for position, task in enumerate(tasks):
+        if not isinstance(task, dict):
+            problems.append(f"task {position} is not an object")
+            continue
+        name = task.get("id") or task.get("task_name") or position
+        service_id = task.get("service_id")
+        operation = str(task.get("operation", "")).upper()
+        endpoint = task.get("endpoint")
+        if service_id not in index.services:
+            problems.append(f"task {name}: unknown service {service_id}")
+        elif operation not in OPERATIONS:
+            problems.append(f"task {name}: invalid operation {task.get('operation')}")
+        elif not isinstance(endpoint, str) or not endpoint:
+            problems.append(f"task {name}: missing endpoint")
+        # References to other tasks' results stand for a concrete path segment.
+        elif index.match(service_id, operation, REFERENCE.sub("ref", endpoint)) is None:
+            problems.append(f"task {name}: {operation} {endpoint} is not an operation of {service_id}")
+
+    # build_graph reports indices into the list it is given; map them back to plan positions.
+    positions = [position for position, task in enumerate(tasks) if isinstance(task, dict)]
+    _, _, errors = _graph.build_graph([tasks[position] for position in positions])
+    problems.extend(f"task {positions[index]}: {reason}" for index, reason in sorted(errors.items()))
+    return problems
@@ -0,0 +1,113 @@
+import logging
+import math
+import os
+import re
+import threading
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+|[^\sA-Za-z0-9]")
+CHARS_PER_TOKEN = float(os.environ.get("PROMPT_CHARS_PER_TOKEN", "4"))
+# tokenizer.json file or Hugging Face model id of the planner's tokenizer; the
+# heuristic count is used when it is not set or cannot be loaded.
+PLANNER_TOKENIZER = os.environ.get("PLANNER_TOKENIZER", "")
+
+logger = logging.getLogger("control-unit")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def load_tokenizer():
+    """
+    Loads the planner's tokenizer (PLANNER_TOKENIZER), downloading it from Hugging
+    Face if needed. Called once at startup, so requests never wait for the download.
+    """
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is not None:
+            return _tokenizer
+        _tokenizer = False
+        if not PLANNER_TOKENIZER:
+            return _tokenizer
+        try:
+            from tokenizers import Tokenizer
+            if os.path.isfile(PLANNER_TOKENIZER):
+                _tokenizer = Tokenizer.from_file(PLANNER_TOKENIZER)
+            else:
+                _tokenizer = Tokenizer.from_pretrained(PLANNER_TOKENIZER)
+            logger.info(f"[PROMPT] Counting tokens with the {PLANNER_TOKENIZER} tokenizer")
+        except Exception as e:
+            logger.warning(f"[PROMPT] Cannot load tokenizer {PLANNER_TOKENIZER}, estimating token counts: {e}")
+        return _tokenizer
+
+
+def estimate_tokens(text):
+    """
+    Approximate token count of a prompt: every punctuation character is a token
+    and alphanumeric runs are split in pieces of PROMPT_CHARS_PER_TOKEN characters,
+    which tracks BPE tokenizers closely enough for prompt budgeting.
+    """
+    return sum(
+        math.ceil(len(piece) / CHARS_PER_TOKEN) if piece[0].isalnum() else 1
+        for piece in TOKEN_PATTERN.findall(text)
+    )
+
+
+def count_tokens(text):
+    """
+    Token count of a prompt with the planner's tokenizer (PLANNER_TOKENIZER), or
+    estimate_tokens() if it is not loaded.
+    """
+    if _tokenizer:
+        return len(_tokenizer.encode(text, add_special_tokens=False).ids)
+    return estimate_tokens(text)
+
+
+def _one_line(text):
+    return " ".join(str(text or "").split()).replace("|", "/")
+
+
+def _base_url(endpoints):
+    """
+    URL prefix shared by all the endpoints of a service, if every endpoint URL
+    is that prefix followed by the path of its "METHOD path" key.
+    """
+    bases = set()
+    for key, url in endpoints.items():
+        path = key.split(" ", 1)[-1]
+        if not isinstance(url, str) or not url.endswith(path):
+            return None
+        bases.add(url[:len(url) - len(path)])
+    return bases.pop() if len(bases) == 1 else None
+
+
+def encode_catalog(services, capabilities, endpoints):
+    """
+    Encodes the candidate services as two compact sections: one line per service
+    with its base URL, and one line per operation as `id | METHOD path | capability`.
+    Operations of a service without a common base URL carry the full URL instead.
+    Candidates returned more than once (one hit per capability) are merged.
+    """
+    merged = {}
+    for service, service_capabilities, service_endpoints in zip(services, capabilities, endpoints):
+        entry = merged.setdefault(service.get("_id"), (service, {}, {}))
+        entry[1].update(service_capabilities or {})
+        entry[2].update(service_endpoints or {})
+
+    service_lines = []
+    operation_lines = []
+    for service_id, (service, service_capabilities, service_endpoints) in merged.items():
+        base = _base_url(service_endpoints)
+        service_lines.append(" | ".join([
+            service_id,
+            _one_line(service.get("name")),
+            _one_line(service.get("description")),
+            base or "-"
+        ]))
+
+        for key in dict.fromkeys(list(service_endpoints) + list(service_capabilities)):
+            method, _, path = key.partition(" ")
+            if base is None and key in service_endpoints:
+                path = service_endpoints[key]
+            operation_lines.append(f"{service_id} | {method} {path} | {_one_line(service_capabilities.get(key, ''))}")
+
+    return "\n".join(service_lines), "\n".join(operation_lines)
@@ -0,0 +1,104 @@
+import asyncio
+import copy
+import json
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+
+def resource_path(url):
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path.rstrip('/')}"
+
+
+class ResponseCache:
+    """
+    TTL cache of successful GET responses keyed by URL, with single-flight
+    coalescing of identical in-flight GETs. A POST/PUT/DELETE invalidates the
+    cached entries of its resource path, of everything below it and of its
+    parent collection. Only touched from the shared event loop.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get("TOOL_CACHE_ENABLED", "true").lower() == "true"
+        self.ttl = float(os.environ.get("TOOL_CACHE_TTL", "5"))
+        self.ttls = {k: float(v) for k, v in json.loads(os.environ.get("TOOL_CACHE_TTLS", "{}")).items()}
+        self.max_entries = int(os.environ.get("TOOL_CACHE_SIZE", "1024"))
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._generation = 0
+
+    def ttl_for(self, service_id):
+        return self.ttls.get(service_id, self.ttl)
+
+    def _lookup(self, url):
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            self._entries.pop(url, None)
+            return None
+        self._entries.move_to_end(url)
+        return value
+
+    def _store(self, url, value, ttl):
+        self._entries[url] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def fetch(self, service_id, url, send):
+        """
+        Returns (response, source) where source is "origin", "cache" or "coalesced".
+        send() must return (status_code, ok, result); only ok responses are cached.
+        """
+        if not self.enabled:
+            return await send(), "origin"
+
+        while True:
+            cached = self._lookup(url)
+            if cached is not None:
+                return copy.deepcopy(cached), "cache"
+            inflight = self._inflight.get(url)
+            if inflight is None:
+                break
+            # asyncio.wait does not raise when the leader is cancelled, only when this caller is.
+            await asyncio.wait({inflight})
+            if not inflight.cancelled():
+                return copy.deepcopy(inflight.result()), "coalesced"
+            # The leader was cancelled on behalf of its own caller: send our own GET.
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        generation = self._generation
+        try:
+            response = await send()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(url) is future:
+                del self._inflight[url]
+
+        future.set_result(response)
+        ttl = self.ttl_for(service_id)
+        # A write that ran while the GET was in flight may have made the response stale.
+        if response[1] and ttl > 0 and generation == self._generation:
+            self._store(url, response, ttl)
+        return copy.deepcopy(response), "origin"
+
+    def invalidate(self, url):
+        self._generation += 1
+        path = resource_path(url)
+        parent = path.rsplit("/", 1)[0]
+        for key in list(self._entries):
+            cached = resource_path(key)
+            if cached == path or cached == parent or cached.startswith(path + "/"):
+                self._entries.pop(key, None)
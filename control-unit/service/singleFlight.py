@@ -0,0 +1,79 @@
+import asyncio
+import copy
+import re
+from collections import Counter
+
+
+def normalize_query(query):
+    # Whitespace only: case can change the meaning of a query (IDs, names, units).
+    return re.sub(r"\s+", " ", str(query)).strip()
+
+
+class Flight:
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.listeners = []
+        self.history = []
+        self.task = None
+
+    def emit(self, event, payload):
+        if event != "token":
+            self.history.append((event, payload))
+        for listener in list(self.listeners):
+            listener(event, payload)
+
+
+class SingleFlight:
+    """
+    Coalesces identical work in flight on the shared event loop. The first caller
+    starts the work on a dedicated controller; later callers with the same key
+    wait for the same result. Events are fanned out to every waiter, and events
+    emitted before a waiter joined (except tokens) are replayed to it. The work
+    is cancelled only when every waiter has gone away. Later callers can pass
+    `join` to hand their own urgency over to the flight's controller.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.stats = Counter()
+
+    async def run(self, key, spawn, work, on_event, join=None):
+        """
+        Returns work(controller) for the flight of `key`, starting it with
+        spawn(on_event) if no identical flight is running, or calling
+        join(controller) with the running flight's controller otherwise.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(None)
+            flight.controller = spawn(flight.emit)
+            flight.task = asyncio.ensure_future(work(flight.controller))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._release(key, flight))
+            self.stats["started"] += 1
+        else:
+            self.stats["coalesced"] += 1
+            if join is not None:
+                join(flight.controller)
+            for event, payload in flight.history:
+                on_event(event, payload)
+
+        flight.listeners.append(on_event)
+        try:
+            return copy.deepcopy(await asyncio.shield(flight.task))
+        finally:
+            flight.listeners.remove(on_event)
+            if not flight.listeners and not flight.task.done():
+                flight.controller.cancelled.set()
+                flight.task.cancel()
+
+    def _release(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Retrieve the exception so an unawaited failure is not logged.
+            flight.task.exception()
+
+    def snapshot(self):
+        return {"in_flight": len(self._flights), **self.stats}
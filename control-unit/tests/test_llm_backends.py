@@ -0,0 +1,146 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTROL_UNIT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [CONTROL_UNIT, os.path.dirname(CONTROL_UNIT)]
+
+from service.llmBackends import BackendPool, set_backend_pool  # noqa: E402
+from service import controlService  # noqa: E402
+from service.controlService import Controller  # noqa: E402
+
+MODEL = "planner:test"
+REPLY = '{"tasks": []}'
+
+
+class StandIn:
+    """
+    Local Ollama stand-in: /api/ps lists `loaded`, /api/generate replies with REPLY
+    (streamed as NDJSON or in one JSON body). With `up` false every request fails;
+    with `hang` set generations stall that many seconds before answering.
+    """
+
+    def __init__(self, loaded=()):
+        self.loaded = list(loaded)
+        self.up = True
+        self.hang = 0
+        self.generations = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, content_type="application/json"):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if not stand_in.up:
+                    return self.reply(503, json.dumps({"error": "down"}))
+                self.reply(200, json.dumps({"models": [{"name": m, "model": m} for m in stand_in.loaded]}))
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if not stand_in.up:
+                    return self.reply(500, json.dumps({"error": "model runner crashed"}))
+                time.sleep(stand_in.hang)
+                stand_in.generations += 1
+                if not request.get("stream", True):
+                    return self.reply(200, json.dumps({"model": request["model"], "response": REPLY, "done": True}))
+                chunks = [{"response": REPLY, "done": False}, {"response": "", "done": True}]
+                self.reply(200, "".join(json.dumps(c) + "\n" for c in chunks), "application/x-ndjson")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class BackendPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cold = StandIn()
+        self.warm = StandIn(loaded=[MODEL])
+        self.pool = BackendPool([self.cold.url, self.warm.url])
+        set_backend_pool(self.pool)
+
+    def tearDown(self):
+        set_backend_pool(None)
+        self.cold.close()
+        self.warm.close()
+
+    def backend(self, stand_in):
+        return next(b for b in self.pool.backends if b.url == stand_in.url)
+
+    def check_all(self):
+        for backend in self.pool.backends:
+            self.pool.check(backend)
+
+    def test_routes_to_the_backend_holding_the_model(self):
+        self.check_all()
+        self.assertEqual(self.pool.choose(MODEL).url, self.warm.url)
+        self.assertEqual(self.pool.choose(MODEL, exclude={self.warm.url}).url, self.cold.url)
+        self.assertIsNone(self.pool.choose(MODEL, exclude={self.warm.url, self.cold.url}))
+
+    def test_routes_to_the_backend_running_the_context_size(self):
+        self.check_all()
+        self.pool.mark_loaded(self.backend(self.cold), MODEL, 16384)
+        self.pool.mark_loaded(self.backend(self.warm), MODEL, 8192)
+        self.assertEqual(self.pool.choose(MODEL, num_ctx=16384).url, self.cold.url)
+        self.assertEqual(self.pool.choose(MODEL, num_ctx=8192).url, self.warm.url)
+
+    def test_health_checks_mark_backends(self):
+        self.warm.up = False
+        self.check_all()
+        self.assertFalse(self.backend(self.warm).healthy)
+        self.assertTrue(self.backend(self.cold).healthy)
+        # Unhealthy backends are skipped even when they hold the model.
+        self.assertEqual(self.pool.choose(MODEL).url, self.cold.url)
+
+        self.warm.up = True
+        self.check_all()
+        self.assertTrue(self.backend(self.warm).healthy)
+        self.assertEqual(self.pool.choose(MODEL).url, self.warm.url)
+
+    def test_fails_over_to_the_next_backend(self):
+        self.check_all()
+        self.warm.up = False
+        events = []
+        controller = Controller(on_event=lambda event, payload: events.append((event, payload)))
+
+        self.assertEqual(json.loads(controller.query_ollama("QUERY:\ntest\n<|end|>", MODEL)), {"tasks": []})
+
+        self.assertEqual(self.cold.generations, 1)
+        self.assertEqual([payload["backend"] for event, payload in events if event == "failover"], [self.warm.url])
+        self.assertFalse(self.backend(self.warm).healthy)
+        self.assertEqual(self.backend(self.warm).failures, 1)
+        # A successful generation marks the model as loaded on the backend that served it.
+        self.assertIn(MODEL, self.backend(self.cold).models)
+
+    def test_fails_over_from_a_stalled_backend(self):
+        self.check_all()
+        self.warm.hang = 2
+        with mock.patch.object(controlService, "LLM_READ_TIMEOUT", 0.5):
+            text = Controller().query_ollama("QUERY:\ntest\n<|end|>", MODEL)
+
+        self.assertEqual(json.loads(text), {"tasks": []})
+        self.assertEqual(self.cold.generations, 1)
+        self.assertEqual(self.backend(self.warm).failures, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,17 +1,19 @@
 from flask import Flask, request, jsonify
 from pymongo import MongoClient
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import VectorParams, Distance, PointStruct, SearchRequest
 from bson import ObjectId
 from bson.json_util import dumps
 from cheroot.wsgi import Server as WSGIServer
 import multiprocessing
+import time
 import uuid
 import os
 import sys
 import logging
 import bson
 import json
+from common import tracing, profiling
 
 from sentence_transformers import SentenceTransformer, CrossEncoder
 
@@ -28,6 +30,8 @@ logging.basicConfig(
 logger = logging.getLogger("app")
 
 app = Flask(__name__)
+tracing.instrument_flask(app)
+profiling.instrument_flask(app)
 
 MONGO_USER = os.environ.get("MONGO_USER", "admin")
 MONGO_PASS = os.environ.get("MONGO_PASS", "admin")
@@ -35,21 +39,49 @@ MONGO_HOST = os.environ.get("MONGO_HOST", "catalog-data")
 MONGO_PORT = os.environ.get("MONGO_PORT", "27017")
 MONGO_DB = os.environ.get("MONGO_DB", "microcks")
 MONGO_URI = f"mongodb://{MONGO_USER}:{MONGO_PASS}@{MONGO_HOST}:{MONGO_PORT}/"
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primaryPreferred")
 
 
 QDRANT_HOST = os.environ.get("QDRANT_HOST", "catalog-vector")
 QDRANT_PORT = os.environ.get("QDRANT_PORT", "6333")
+QDRANT_GRPC_PORT = os.environ.get("QDRANT_GRPC_PORT", "6334")
+QDRANT_PREFER_GRPC = os.environ.get("QDRANT_PREFER_GRPC", "true").lower() == "true"
+QDRANT_TIMEOUT = int(os.environ.get("QDRANT_TIMEOUT", "10"))
 QDRANT_COLLECTION = os.environ.get("QDRANT_COLLECTION", "services")
 QDRANT_URI = f"http://{QDRANT_HOST}:{QDRANT_PORT}"
 
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "10"))
 
-mongo_client = MongoClient(MONGO_URI)
-qdrant_client = QdrantClient(QDRANT_URI)
+
+mongo_client = MongoClient(
+    MONGO_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    readPreference=MONGO_READ_PREFERENCE
+)
+qdrant_client = QdrantClient(
+    host=QDRANT_HOST,
+    port=int(QDRANT_PORT),
+    grpc_port=int(QDRANT_GRPC_PORT),
+    prefer_grpc=QDRANT_PREFER_GRPC,
+    timeout=QDRANT_TIMEOUT
+)
 
 db = mongo_client[MONGO_DB]
 collection = db["services"]
 
 is_server_ready = False
+backend_latency = {}
 embedding_model = None
 reranker_model = None
 tokenizer = None
@@ -112,39 +144,56 @@ def create_vector_collection():
     else:
         return jsonify({"status": f"Collection '{collection_name}' already exists"}), 200
 
+def check_backends():
+    """
+    Measures one round trip to each backend. Informational only: failures are
+    logged and never stop the server from starting.
+    """
+    transport = "grpc" if QDRANT_PREFER_GRPC else "rest"
+    probes = {
+        "mongo_ms": lambda: mongo_client.admin.command("ping"),
+        f"qdrant_{transport}_ms": lambda: qdrant_client.get_collection(QDRANT_COLLECTION),
+    }
+    for name, probe in probes.items():
+        start = time.perf_counter()
+        try:
+            probe()
+        except Exception as e:
+            logger.warning(f"Backend round-trip check {name[:-len('_ms')]} failed: {e}")
+            continue
+        backend_latency[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    logger.info(f"Backend round-trip latency: {backend_latency}")
+    return backend_latency
+
 @app.route("/health")
 def index():
     if is_server_ready is True:
-        return jsonify({"status": "ok", "message": "Gateway Server is ready", "model_loaded": True}), 200
+        return jsonify({"status": "ok", "message": "Gateway Server is ready", "model_loaded": True, "backend_latency": backend_latency}), 200
     else:
         logger.error(f"Model not yet loaded or broken")
         return jsonify({"status": "error", "message": "Model not yet loaded or broken", "model_loaded": False}), 500
         
 
 
-@app.route("/index/search", methods=["POST"])
-def vector_search():
-    data = request.get_json()
-    if not data or "query" not in data:
-        return jsonify({"error": "Missing 'query' field"}), 400
+SEARCH_LIMIT = int(os.environ.get("SEARCH_LIMIT", "20"))
+SEARCH_MAX_TOKENS = int(os.environ.get("SEARCH_MAX_TOKENS", "7600"))
+SEARCH_BATCH_MAX = int(os.environ.get("SEARCH_BATCH_MAX", "64"))
 
-    query_text = data["query"]
-    query_embedding = embed(query_text)
 
-    results = qdrant_client.search(
-        collection_name=QDRANT_COLLECTION,
-        query_vector=query_embedding,
-        limit=20
-    )
+def fetch_documents(hits):
+    doc_ids = list({result.payload["mongo_id"] for result in hits})
+    return {doc["_id"]: doc for doc in collection.find({"_id": {"$in": doc_ids}})}
+
 
+def collect_services(hits, retrieved_docs):
     services = []
     rerank_texts = []
-    for result in results:
+    for result in hits:
         doc_id = result.payload["mongo_id"]
         http_operation = result.payload["http_operation"]
 
-        retrieved = collection.find_one({"_id": doc_id})
-        retrieved = bson.json_util.loads(dumps(retrieved))
+        retrieved = bson.json_util.loads(dumps(retrieved_docs.get(doc_id)))
         try:
             name = retrieved.get("name")
             description = retrieved.get("description")
@@ -170,17 +219,19 @@ def vector_search():
             services.append(service)
         except Exception as e:
             logger.error(f"Error processing doc_id: {doc_id}, operation: {http_operation} - {str(e)}")
-    
-    rerank_inputs = [(query_text, cap_text) for cap_text in rerank_texts]
-    scores = reranker_model.predict(rerank_inputs)
+    return services, rerank_texts
+
 
+def select_services(services, scores, max_tokens=SEARCH_MAX_TOKENS):
+    """
+    The best ranked services fitting in max_tokens. Returns (services, tokens used).
+    """
     reranked = sorted(zip(services, scores), key=lambda x: x[1], reverse=True)
     ordered_services = [doc for doc, _ in reranked]
 
-    max_tokens = 7600
     current_tokens = 0
     top_results = []
-    
+
     for s in ordered_services:
         serialized = json.dumps(s)
         n_tokens = count_tokens(serialized)
@@ -190,8 +241,104 @@ def vector_search():
             current_tokens += n_tokens
         else:
             break
-            
-    return jsonify({"results": top_results}), 200
+    return top_results, current_tokens
+
+
+def token_budget(value):
+    """
+    The token budget requested by the caller, capped at SEARCH_MAX_TOKENS.
+    """
+    if value is None:
+        return SEARCH_MAX_TOKENS
+    return max(0, min(int(value), SEARCH_MAX_TOKENS))
+
+
+@app.route("/index/search", methods=["POST"])
+def vector_search():
+    data = request.get_json()
+    if not data or "query" not in data:
+        return jsonify({"error": "Missing 'query' field"}), 400
+
+    query_text = data["query"]
+    try:
+        max_tokens = token_budget(data.get("max_tokens"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'max_tokens' must be an integer"}), 400
+    with tracing.span("Embed"):
+        query_embedding = embed(query_text)
+
+    with tracing.span("Qdrant search", tracing.CLIENT, **{"db.system": "qdrant"}):
+        results = qdrant_client.search(
+            collection_name=QDRANT_COLLECTION,
+            query_vector=query_embedding,
+            limit=SEARCH_LIMIT
+        )
+
+    with tracing.span("Mongo lookup", tracing.CLIENT, **{"db.system": "mongodb"}):
+        retrieved_docs = fetch_documents(results)
+    services, rerank_texts = collect_services(results, retrieved_docs)
+
+    rerank_inputs = [(query_text, cap_text) for cap_text in rerank_texts]
+    with tracing.span("Rerank", pairs=len(rerank_inputs)):
+        scores = reranker_model.predict(rerank_inputs)
+
+    selected, tokens = select_services(services, scores, max_tokens)
+    response = {"results": selected, "tokens": tokens}
+    if data.get("return_embedding"):
+        response["query_embedding"] = query_embedding
+    return jsonify(response), 200
+
+
+@app.route("/index/search/batch", methods=["POST"])
+def vector_search_batch():
+    """
+    Same as /index/search for a list of queries: one embedding batch, one Qdrant
+    batch search, one Mongo lookup and one reranker pass for all of them.
+    """
+    data = request.get_json()
+    if not data or not isinstance(data.get("queries"), list) or not data["queries"]:
+        return jsonify({"error": "Missing 'queries' list"}), 400
+    queries = [str(q) for q in data["queries"]]
+    if len(queries) > SEARCH_BATCH_MAX:
+        return jsonify({"error": f"At most {SEARCH_BATCH_MAX} queries per batch"}), 400
+    budgets = data.get("max_tokens")
+    if not isinstance(budgets, list):
+        budgets = [budgets] * len(queries)
+    try:
+        budgets = [token_budget(budget) for budget in budgets]
+    except (TypeError, ValueError):
+        return jsonify({"error": "'max_tokens' must be an integer or a list of integers"}), 400
+    if len(budgets) != len(queries):
+        return jsonify({"error": "'max_tokens' must have one entry per query"}), 400
+
+    with tracing.span("Embed", queries=len(queries)):
+        query_embeddings = embedding_model.encode(
+            [f"query: {q}" for q in queries], convert_to_tensor=False, normalize_embeddings=True
+        ).tolist()
+
+    with tracing.span("Qdrant search", tracing.CLIENT, **{"db.system": "qdrant"}):
+        batch_results = qdrant_client.search_batch(
+            collection_name=QDRANT_COLLECTION,
+            requests=[SearchRequest(vector=vector, limit=SEARCH_LIMIT, with_payload=True) for vector in query_embeddings]
+        )
+    with tracing.span("Mongo lookup", tracing.CLIENT, **{"db.system": "mongodb"}):
+        retrieved_docs = fetch_documents([hit for hits in batch_results for hit in hits])
+
+    collected = [collect_services(hits, retrieved_docs) for hits in batch_results]
+    rerank_inputs = [(query_text, cap_text) for query_text, (_, texts) in zip(queries, collected) for cap_text in texts]
+    with tracing.span("Rerank", pairs=len(rerank_inputs)):
+        scores = list(reranker_model.predict(rerank_inputs)) if rerank_inputs else []
+
+    responses = []
+    offset = 0
+    for query_embedding, budget, (services, texts) in zip(query_embeddings, budgets, collected):
+        selected, tokens = select_services(services, scores[offset:offset + len(texts)], budget)
+        response = {"results": selected, "tokens": tokens}
+        offset += len(texts)
+        if data.get("return_embedding"):
+            response["query_embedding"] = query_embedding
+        responses.append(response)
+    return jsonify({"results": responses}), 200
 
 
 @app.route("/service", methods=["POST"])
@@ -280,6 +427,8 @@ if __name__ == "__main__":
         with app.app_context():
             logger.info("🛠️ Creating Qdrant collection...")
             create_vector_collection()
+            logger.info("📡 Checking backend round-trip latency...")
+            check_backends()
             logger.info("📦 Loading embedding model...")
             load_model()
             is_server_ready = True
@@ -288,7 +437,7 @@ if __name__ == "__main__":
         logger.exception("❌ Failed to initialize application")
         sys.exit(1)
 
-    server = WSGIServer(('0.0.0.0', 5000), app)
+    server = WSGIServer(('0.0.0.0', 5000), app, numthreads=SERVER_THREADS)
     try:
         print("🚀 Starting Flask app with Cheroot on http://0.0.0.0:5000")
         server.start()
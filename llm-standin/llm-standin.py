@@ -0,0 +1,208 @@
+from flask import Flask, request, jsonify, Response, stream_with_context
+from cheroot.wsgi import Server as WSGIServer
+from datetime import datetime, timezone
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+logger = logging.getLogger("app")
+
+app = Flask(__name__)
+
+# execution_plans.json files written by submitter.py, replayed as planner replies.
+STANDIN_PLANS = os.environ.get("STANDIN_PLANS", "/plans/**/execution_plans.json")
+STANDIN_PORT = int(os.environ.get("STANDIN_PORT", "11434"))
+STANDIN_SEED = int(os.environ.get("STANDIN_SEED", "0"))
+# Generation slots, like OLLAMA_NUM_PARALLEL; further requests wait for a slot.
+STANDIN_PARALLEL = int(os.environ.get("STANDIN_PARALLEL", "1"))
+# Latency model: a cold load on the first request of each model (and after
+# STANDIN_KEEP_ALIVE seconds idle), prefill and decode at fixed token rates,
+# scaled by a per-request jitter factor drawn from STANDIN_JITTER.
+STANDIN_LOAD_MS = float(os.environ.get("STANDIN_LOAD_MS", "0"))
+STANDIN_KEEP_ALIVE = float(os.environ.get("STANDIN_KEEP_ALIVE", "1800"))
+STANDIN_PREFILL_TPS = float(os.environ.get("STANDIN_PREFILL_TPS", "1500"))
+STANDIN_DECODE_TPS = float(os.environ.get("STANDIN_DECODE_TPS", "40"))
+# "fixed", "lognormal:<sigma>", "normal:<sigma>" or "uniform:<low>:<high>".
+STANDIN_JITTER = os.environ.get("STANDIN_JITTER", "lognormal:0.25")
+STANDIN_THINK_MODELS = [m.strip() for m in os.environ.get("STANDIN_THINK_MODELS", "phi4-reasoning:14b").split(",") if m.strip()]
+STANDIN_THINK_TOKENS = int(os.environ.get("STANDIN_THINK_TOKENS", "64"))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "16"))
+
+QUERY_PATTERN = re.compile(r"QUERY:\s*\n(.*?)\n<\|end\|>", flags=re.DOTALL)
+TOKEN_PATTERN = re.compile(r"\s*\S{1,4}|\s+")
+CHARS_PER_TOKEN = 4
+
+slots = threading.Semaphore(STANDIN_PARALLEL)
+loaded = {}
+loaded_lock = threading.Lock()
+plans = {}
+
+
+def normalize_question(question):
+    return re.sub(r"\s+", " ", str(question)).strip().lower()
+
+
+def load_plans():
+    for path in sorted(glob.glob(STANDIN_PLANS, recursive=True)):
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+        for record in records:
+            plan = record.get("execution_plan")
+            if isinstance(plan, dict) and plan.get("tasks"):
+                plans.setdefault(normalize_question(record.get("question", "")), plan)
+    logger.info(f"Loaded {len(plans)} recorded plans from {STANDIN_PLANS}")
+
+
+def jitter(rng):
+    kind, _, args = STANDIN_JITTER.partition(":")
+    params = [float(p) for p in args.split(":") if p]
+    if kind == "lognormal":
+        sigma = params[0] if params else 0.25
+        # Mean 1, so the configured rates stay the average rates.
+        return rng.lognormvariate(-sigma * sigma / 2, sigma)
+    if kind == "normal":
+        return max(0.05, rng.gauss(1.0, params[0] if params else 0.1))
+    if kind == "uniform":
+        low, high = (params + [0.5, 1.5][len(params):])[:2]
+        return rng.uniform(low, high)
+    return 1.0
+
+
+def extract_query(prompt):
+    """
+    The user query of a planner prompt: the last QUERY section, so follow-up turns
+    of a re-prompt replay the same plan.
+    """
+    matches = QUERY_PATTERN.findall(prompt)
+    return matches[-1].strip() if matches else prompt.strip()
+
+
+def reply_for(prompt, model):
+    """
+    The recorded plan of the query in the prompt or, for unknown queries, a recorded
+    plan chosen by the hash of the query, so replies are deterministic.
+    """
+    query = normalize_question(extract_query(prompt))
+    plan = plans.get(query)
+    if plan is None and plans:
+        keys = sorted(plans)
+        plan = plans[keys[int(hashlib.sha256(query.encode("utf-8")).hexdigest(), 16) % len(keys)]]
+    text = json.dumps(plan if plan is not None else {"tasks": []})
+    if model in STANDIN_THINK_MODELS:
+        thought = " ".join(["hmm"] * STANDIN_THINK_TOKENS)
+        text = f"<think>{thought}</think>\n{text}"
+    return text
+
+
+def schedule(prompt, model):
+    """
+    Latencies of one request in seconds (load, prefill, per-token decode) and its
+    prompt size in tokens. The jitter factor is seeded by the request, so the same
+    request always gets the same latencies.
+    """
+    rng = random.Random(f"{STANDIN_SEED}:{model}:{prompt}")
+    factor = jitter(rng)
+    now = time.monotonic()
+    with loaded_lock:
+        last_used = loaded.get(model)
+        loaded[model] = now
+    cold = last_used is None or now - last_used > STANDIN_KEEP_ALIVE
+    load = STANDIN_LOAD_MS / 1000 if cold else 0.0
+    prompt_tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN)
+    prefill = prompt_tokens / STANDIN_PREFILL_TPS * factor
+    decode = factor / STANDIN_DECODE_TPS
+    return load, prefill, decode, prompt_tokens
+
+
+def created_at():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def final_chunk(model, text, started, load, prefill, prompt_tokens, tokens):
+    return {
+        "model": model,
+        "created_at": created_at(),
+        "response": text,
+        "done": True,
+        "done_reason": "stop",
+        "total_duration": int((time.monotonic() - started) * 1e9),
+        "load_duration": int(load * 1e9),
+        "prompt_eval_count": prompt_tokens,
+        "prompt_eval_duration": int(prefill * 1e9),
+        "eval_count": tokens,
+        "eval_duration": int((time.monotonic() - started - load - prefill) * 1e9),
+    }
+
+
+@app.route("/api/generate", methods=["POST"])
+def generate():
+    data = request.get_json(force=True)
+    model = data.get("model", "")
+    prompt = data.get("prompt", "")
+    text = reply_for(prompt, model)
+    tokens = TOKEN_PATTERN.findall(text)
+
+    if not data.get("stream", True):
+        started = time.monotonic()
+        with slots:
+            load, prefill, decode, prompt_tokens = schedule(prompt, model)
+            time.sleep(load + prefill + decode * len(tokens))
+        return jsonify(final_chunk(model, text, started, load, prefill, prompt_tokens, len(tokens)))
+
+    def stream():
+        started = time.monotonic()
+        with slots:
+            load, prefill, decode, prompt_tokens = schedule(prompt, model)
+            time.sleep(load + prefill)
+            next_token = time.monotonic()
+            for token in tokens:
+                # Sleep to an absolute schedule so the decode rate does not drift.
+                next_token += decode
+                time.sleep(max(0.0, next_token - time.monotonic()))
+                yield json.dumps({"model": model, "created_at": created_at(), "response": token, "done": False}) + "\n"
+        yield json.dumps(final_chunk(model, "", started, load, prefill, prompt_tokens, len(tokens))) + "\n"
+
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
+
+@app.route("/api/ps", methods=["GET"])
+def running_models():
+    now = time.monotonic()
+    with loaded_lock:
+        models = [m for m, last_used in loaded.items() if now - last_used <= STANDIN_KEEP_ALIVE]
+    return jsonify({"models": [{"name": m, "model": m} for m in models]})
+
+
+@app.route("/api/tags", methods=["GET"])
+def tags():
+    return jsonify({"models": [{"name": m, "model": m} for m in STANDIN_THINK_MODELS]})
+
+
+@app.route("/health")
+def health():
+    return jsonify({"status": "ok", "plans": len(plans)}), 200
+
+
+if __name__ == "__main__":
+    load_plans()
+    server = WSGIServer(("0.0.0.0", STANDIN_PORT), app, numthreads=SERVER_THREADS)
+    try:
+        print(f"🚀 Starting LLM stand-in on http://0.0.0.0:{STANDIN_PORT}")
+        server.start()
+    except KeyboardInterrupt:
+        print("🛑 Shutting down server...")
+        server.stop()